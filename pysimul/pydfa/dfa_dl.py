@@ -1,7 +1,17 @@
 #!/usr/bin/env python3
 
 from math import isqrt
-from random import randint
+from random import randint, Random
+from bisect import bisect_left
+from array import array
+from hashlib import sha256
+import json
+import mmap
+import os
+import struct
+import sys
+
+from pydfa.ec import batch_invert
 
 ## for Python versions < 3.8, remove the import of isqrt and use the code below
 # def isqrt(n):
@@ -18,11 +28,186 @@ from random import randint
 #         raise ValueError("Square root not defined for negative numbers")
 
 
+## baby-step tables
+
+# directory where tables are saved and memory-mapped from (None: tables are only kept in memory)
+TABLE_DIR = None
+
+# tables already built or loaded in this process, keyed by (curve, base, range)
+_TABLES = dict()
+
+TABLE_MAGIC = b'DFABST\x00\x01'
+FINGERPRINT_MASK = 2**64 - 1
+
+
+def set_table_dir(dirname):
+    '''Tables built from now on are saved in `dirname`, and loaded from it when they already exist'''
+    global TABLE_DIR
+    if dirname is not None:
+        os.makedirs(dirname, exist_ok=True)
+    TABLE_DIR = dirname
+
+
+class BabyStepTable:
+    '''
+    Baby steps [j]a for j in range(m) with the giant step -[m]a.
+    The table only depends on the curve, the base `a` and the range `m`, so it is shared by all discrete logs
+    computed with the same parameters (see `baby_step_table`).
+
+    Only the truncated x-coordinates (64 bits) of the points are kept, sorted, in an array with the array of
+    the corresponding indices j (12 bytes per baby step instead of a dictionary of points);
+    a match on the truncated x-coordinate is verified with a scalar multiplication.
+    Saved on disk, the table is stored as these two arrays, which are memory-mapped when loaded.
+    '''
+
+    def __init__(self, curve, a, m, giant=None, fingerprints=None, indices=None):
+        self.curve = curve
+        self.base = a
+        self.m = m
+        self.giant = giant if giant is not None else curve.neg(curve.mul(m, a))
+        self._mmap = None
+        if fingerprints is None:
+            fingerprints, indices = self._build()
+        self.fingerprints = fingerprints
+        self.indices = indices
+
+    def _build(self):
+        '''Computes the fingerprints of the baby steps and sorts them'''
+        infty = self.curve.infty
+        fps = array('Q', (0 if P == infty else P[0].to_int() & FINGERPRINT_MASK for P in self.curve.multiples(self.base, self.m)))
+        order = sorted(range(self.m), key=fps.__getitem__)
+        fingerprints = array('Q', (fps[j] for j in order))
+        indices = array('I' if self.m < 2**32 else 'Q', order)
+        return fingerprints, indices
+
+    def __len__(self):
+        return self.m
+
+    def lookup(self, P):
+        '''Returns j such that P = [j]a with 0 <= j < m, or None'''
+        if P == self.curve.infty:
+            return 0
+        fp = P[0].to_int() & FINGERPRINT_MASK
+        i = bisect_left(self.fingerprints, fp)
+        while i < self.m and self.fingerprints[i] == fp:
+            j = self.indices[i]
+            if self.curve.mul(j, self.base) == P:
+                return j
+            i += 1
+        return None
+
+    def lookup_x(self, P):
+        '''Returns j such that P = [j]a or P = -[j]a (then -j is returned) with 0 <= j < m, or None'''
+        if P == self.curve.infty:
+            return 0
+        fp = P[0].to_int() & FINGERPRINT_MASK
+        i = bisect_left(self.fingerprints, fp)
+        while i < self.m and self.fingerprints[i] == fp:
+            j = self.indices[i]
+            R = self.curve.mul(j, self.base)
+            if R[0] == P[0]:
+                return j if R[1] == P[1] else -j
+            i += 1
+        return None
+
+    def save(self, filename):
+        '''
+        File format (little-endian):
+            magic (8 bytes), length of header (4 bytes), header in JSON, padding to a multiple of 8 bytes,
+            m fingerprints (8 bytes each, sorted), m indices (4 bytes each)
+        '''
+        if self.m >= 2**32:
+            raise ValueError('Table too large to be saved')
+        fingerprints = array('Q', self.fingerprints)
+        indices = array('I', self.indices)
+        if sys.byteorder != 'little':
+            fingerprints.byteswap()
+            indices.byteswap()
+
+        header = json.dumps({
+            'curve': self.curve.name,
+            'p'    : hex(self.curve.p),
+            'base' : [self.base[0].hex(), self.base[1].hex()],
+            'm'    : self.m,
+            'giant': [self.giant[0].hex(), self.giant[1].hex()]
+        }).encode()
+        header += b' '*(-(len(TABLE_MAGIC) + 4 + len(header)) % 8)
+
+        tmpname = f'{filename}.{os.getpid()}.tmp'
+        with open(tmpname, 'wb') as f:
+            f.write(TABLE_MAGIC)
+            f.write(struct.pack('<I', len(header)))
+            f.write(header)
+            fingerprints.tofile(f)
+            indices.tofile(f)
+        os.replace(tmpname, filename)
+
+    @classmethod
+    def load(cls, curve, filename):
+        '''Memory-maps a table saved with `save`'''
+        with open(filename, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if mm[:len(TABLE_MAGIC)] != TABLE_MAGIC:
+            raise ValueError(f'{filename} is not a baby-step table')
+        offset = len(TABLE_MAGIC) + 4
+        hlen, = struct.unpack('<I', mm[len(TABLE_MAGIC):offset])
+        header = json.loads(mm[offset:offset + hlen].decode())
+        if header['curve'] != curve.name or int(header['p'], 16) != curve.p:
+            raise ValueError(f'{filename} is a table for another curve')
+        offset += hlen
+
+        m = header['m']
+        buf = memoryview(mm)
+        if sys.byteorder == 'little':
+            fingerprints = buf[offset:offset + 8*m].cast('Q')
+            indices = buf[offset + 8*m:offset + 12*m].cast('I')
+        else:
+            fingerprints = array('Q', buf[offset:offset + 8*m])
+            indices = array('I', buf[offset + 8*m:offset + 12*m])
+            fingerprints.byteswap()
+            indices.byteswap()
+
+        base = tuple(curve.field(int(x, 16)) for x in header['base'])
+        giant = tuple(curve.field(int(x, 16)) for x in header['giant'])
+        table = cls(curve, base, m, giant, fingerprints, indices)
+        table._mmap = mm
+        return table
+
+
+def table_filename(curve, a, m):
+    h = sha256(f'{a[0].hex()},{a[1].hex()}'.encode()).hexdigest()[:16]
+    return os.path.join(TABLE_DIR, f'{curve.name}_{h}_{m}.bst')
+
+
+def baby_step_table(curve, a, m):
+    '''Returns the table of baby steps [j]a for j in range(m), built once per process (and saved if TABLE_DIR is set)'''
+    key = (type(curve).__name__, curve.name, a[0].to_int(), a[1].to_int(), m)
+    table = _TABLES.get(key)
+    if table is not None:
+        return table
+
+    if TABLE_DIR is not None:
+        filename = table_filename(curve, a, m)
+        if os.path.exists(filename):
+            table = BabyStepTable.load(curve, filename)
+        else:
+            table = BabyStepTable(curve, a, m)
+            table.save(filename)
+    else:
+        table = BabyStepTable(curve, a, m)
+
+    _TABLES[key] = table
+    return table
+
+
 def bsgs(curve, b, a, bounds):
     '''
     Adapted from SageMath in the file src/sage/groups/generic.py
     Credits to the original author:
     - John Cremona (2008-03-15)
+
+    The baby steps do not depend on `b` nor `lb`, so the table is shared between calls (see baby_step_table)
     '''
     lb, ub = bounds
     if lb < 0 or ub < lb:
@@ -30,7 +215,7 @@ def bsgs(curve, b, a, bounds):
     
     ran = 1 + ub - lb   # the length of the interval
 
-    tmp1 = curve.ladder(lb, a)
+    tmp1 = curve.mul(lb, a)
     tmp2 = curve.neg(b)
     c = curve.add_aff(tmp1, tmp2)
 
@@ -45,69 +230,320 @@ def bsgs(curve, b, a, bounds):
         raise ValueError("No solution in bsgs()")
 
     m = isqrt(ran) + 1   # we need sqrt(ran) rounded up
-    table = dict()       # will hold pairs (a^(lb+i),lb+i) for i in range(m)
-
-    d = c
-    for i0 in range(m):
-        i = lb + i0
-        if curve.infty == d:        # identity == b^(-1)*a^i, so return i
-            return i
-        table[d] = i
-        d = curve.add_aff(d, a)
-
-    c = curve.add_aff(c, curve.neg(d))     # this is now a**(-m)
-    d = curve.infty
-    for i in range(m):
-        j = table.get(d)
-        if j is not None:  # then d == b*a**(-i*m) == a**j
-            return i * m + j
-        d = curve.add_aff(c, d)
+    table = baby_step_table(curve, a, m)  # holds pairs (a^j, j) for j in range(m)
+
+    c = curve.neg(c)     # this is b*a^(-lb)
+    for i, d in enumerate(curve.multiples(table.giant, m, c, batch_size=64)):
+        j = table.lookup(d)
+        if j is not None:  # then d == b*a**(-lb-i*m) == a**j
+            return lb + i * m + j
 
     raise ValueError(f"Log of {b} to the base {a} does not exist in {bounds}.")
 
 
-## The code below could be used as a replacement for bsgs and needs less memory,
-## but it takes longer time if the discrete log does not exist
-# def discrete_log_lambda(curve, a, base, bounds, hash_function=hash):
-#     '''
-#     Adapted from SageMath in the file src/sage/groups/generic.py
-#     Credits to the original author:
-#         -- Yann Laigle-Chapuy (2009-01-25)
-#     '''
-  
-#     lb, ub = bounds
-#     if lb < 0 or ub < lb:
-#         raise ValueError("discrete_log_lambda() requires 0<=lb<=ub")
-
-#     width = ub - lb
-#     N = isqrt(width) + 1
-
-#     M = dict()
-#     for s in range(10):  # to avoid infinite loops
-#         # random walk function setup
-#         k = 0
-#         while 2**k < N:
-#             r = randint(1, N - 1)
-#             M[k] = (r, curve.ladder(r, base))
-#             k += 1
-#         # first random walk
-#         H = curve.ladder(ub, base)
-#         c = ub
-#         for i in range(N):
-#             r, e = M[hash_function(H) % k]
-#             H = curve.add_aff(H, e)
-#             c += r
-#         mem = set([H])
-#         # second random walk
-#         H = a
-#         d = 0
-#         while c - d >= lb:
-#             # print('mem:', mem)
-#             if ub > c - d and H in mem:
-#                 return c - d
-#             r, e = M[hash_function(H) % k]
-#             H = curve.add_aff(H, e)
-#             d += r
-
-#     raise ValueError("Pollard Lambda failed to find a log")
+def bsgs_symmetric(curve, targets, a, N):
+    '''
+    Discrete logarithms e in [-N, N] of the points of `targets` to the base a.
+    Baby steps are matched on the x-coordinate only, so that [j]a in the table also stands for -[j]a
+    and the sign is resolved afterwards: the table has half the size of the one of bsgs for the same
+    number of giant steps. The giant steps of all the targets are done together (e.g. both points given
+    by lift_x in one search).
+    Returns the list of (t, e) such that targets[t] = [e]a for all the targets found (in the order of `targets`),
+    raises ValueError if there is none.
+    '''
+    if N < 0:
+        raise ValueError("bsgs_symmetric() requires 0<=N")
+
+    if N < 30:      # use simple search for small ranges
+        res = []
+        for t, b in enumerate(targets):
+            d = curve.add_aff(b, curve.mul(N, a))
+            for e in range(-N, N + 1):
+                if d == curve.infty:
+                    res.append((t, e))
+                    break
+                d = curve.add_aff(d, curve.neg(a))
+        if len(res) == 0:
+            raise ValueError("No solution in bsgs_symmetric()")
+        return res
+
+    logs = bsgs_multi(curve, targets, a, N, m=isqrt(N) + 1)
+    res = [(t, logs[b]) for t, b in enumerate(targets) if b in logs]
+    if len(res) > 0:
+        return res
+
+    raise ValueError(f"Log of {targets} to the base {a} does not exist in [-{N}, {N}].")
+
+
+def multi_table_size(N, ntargets):
+    '''
+    Number of baby steps for ntargets logarithms in [-N, N]: about sqrt(ntargets*N) to balance the table
+    with the giant steps of all the targets, rounded to a power of 2 so that tables are reused between batches
+    '''
+    m = 2**((isqrt(N*ntargets) + 1).bit_length())
+    return max(2, min(m, 2**BSGS_MULTI_MAX_BITS, N + 1))
+
+
+def bsgs_multi(curve, targets, a, N, m=None):
+    '''
+    Discrete logarithms in [-N, N] of all the points of `targets` to the base a, with a single baby-step table
+    matched on the x-coordinate (see bsgs_symmetric) of m entries (multi_table_size by default): the larger
+    table for many targets means fewer giant steps for each of them.
+    The giant steps of all the targets are done together and normalised with a single inversion per step,
+    the search for a target stops when it is found.
+    Returns a dictionary target -> logarithm for the targets found.
+    '''
+    if N < 0:
+        raise ValueError("bsgs_multi() requires 0<=N")
+
+    logs = dict()
+    if len(targets) == 0:
+        return logs
+
+    if m is None:
+        m = multi_table_size(N, len(targets))
+    table = baby_step_table(curve, a, m)     # baby steps j in range(m) stand for -m < j < m
+    M = 2*m - 1
+    I = N//M + 1            # giant steps b - [i*M]a for -I <= i <= I
+
+    step = curve.neg(curve.mul(M, a))
+    sx, sy = step[0].a, step[1].a
+    start = curve.mul(I*M, a)
+    walks = []
+    for t, b in enumerate(targets):
+        R = curve.add_aff(b, start)
+        walks.append((t, (1, 1, 0) if R == curve.infty else (R[0].a, R[1].a, 1)))
+
+    found = set()
+    for i in range(2*I + 1):
+        points = curve._jac_to_affine_batch_int([R for t, R in walks])
+        for (t, R), d in zip(walks, points):
+            j = table.lookup_x(d)
+            if j is not None:  # then d == b - [(i - I)*M]a == [j]a
+                e = (i - I)*M + j
+                if -N <= e <= N:
+                    logs[targets[t]] = e
+                    found.add(t)
+
+        walks = [(t, curve._madd_jac_int(R, sx, sy)) for t, R in walks if t not in found]
+        if len(walks) == 0:
+            break
+
+    return logs
+
+
+## Pollard's kangaroo (lambda) method with distinguished points, and choice of the method
+
+# method of dlog: 'bsgs', 'kangaroo' or 'auto' (see set_dlog_method)
+DLOG_METHOD = 'bsgs'
+DLOG_METHODS = ('bsgs', 'kangaroo', 'auto')
+
+# approximate size in bytes of an entry of a baby-step table in memory (at most while it is sorted),
+# and part of the available memory a table can take before the method 'auto' switches to the kangaroo method
+BSGS_ENTRY_BYTES = 100
+BSGS_RAM_FRACTION = 0.5
+
+# maximal size (in bits) of the baby-step table of bsgs_multi
+BSGS_MULTI_MAX_BITS = 22
+
+# number of walks of the kangaroo method, and number of steps (in units of sqrt(ub - lb)) after which
+# the logarithm is considered not to be in the interval
+KANGAROO_WALKS = 8
+KANGAROO_MAX_STEPS = 16
+
+
+def set_dlog_method(method):
+    '''Discrete logarithms computed by dlog from now on use `method` (one of DLOG_METHODS)'''
+    global DLOG_METHOD
+    if method not in DLOG_METHODS:
+        raise ValueError(f'Unknown discrete logarithm method {method}, choose amongst: {DLOG_METHODS}')
+    DLOG_METHOD = method
+
+
+def available_memory():
+    '''Returns the available memory in bytes (None if unknown)'''
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1])*1024
+    except OSError:
+        pass
+
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES')*os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def choose_dlog_method(bounds):
+    '''Method chosen by 'auto' for the interval `bounds`: BSGS if its baby-step table fits in memory, kangaroo otherwise'''
+    lb, ub = bounds
+    m = isqrt(1 + ub - lb) + 1
+    mem = available_memory()
+    if mem is None or m*BSGS_ENTRY_BYTES <= BSGS_RAM_FRACTION*mem:
+        return 'bsgs'
+    return 'kangaroo'
+
+
+def dlog_symmetric(curve, targets, a, N):
+    '''
+    Discrete logarithms e in [-N, N] of the points of `targets` to the base a with the method DLOG_METHOD:
+    returns the list of (t, e) such that targets[t] = [e]a for all the targets found (ValueError if there is none)
+    '''
+    method = DLOG_METHOD
+    if method == 'auto':
+        method = choose_dlog_method((0, N))
+    if method != 'kangaroo':
+        return bsgs_symmetric(curve, targets, a, N)
+
+    res = []
+    offset = curve.mul(N, a)
+    for t, b in enumerate(targets):
+        try:
+            res.append((t, kangaroo(curve, curve.add_aff(b, offset), a, (0, 2*N)) - N))
+        except ValueError:
+            pass
+    if len(res) > 0:
+        return res
+    raise ValueError(f"Log of {targets} to the base {a} not found in [-{N}, {N}] by the kangaroo method.")
+
+
+def dlog_multi(curve, targets, a, N):
+    '''
+    Discrete logarithms in [-N, N] of all the points of `targets` to the base a with the method DLOG_METHOD
+    (see bsgs_multi): returns a dictionary target -> logarithm for the targets found
+    '''
+    method = DLOG_METHOD
+    if method == 'auto':
+        method = choose_dlog_method((0, multi_table_size(N, len(targets))**2))
+    if method != 'kangaroo':
+        return bsgs_multi(curve, targets, a, N)
+
+    logs = dict()
+    offset = curve.mul(N, a)
+    for b in targets:
+        try:
+            logs[b] = kangaroo(curve, curve.add_aff(b, offset), a, (0, 2*N)) - N
+        except ValueError:
+            pass
+    return logs
+
+
+def dlog(curve, b, a, bounds):
+    '''Discrete logarithm of b to the base a in the interval `bounds` with the method DLOG_METHOD (ValueError if not found)'''
+    method = DLOG_METHOD
+    if method == 'auto':
+        method = choose_dlog_method(bounds)
+    if method == 'kangaroo':
+        return kangaroo(curve, b, a, bounds)
+    return bsgs(curve, b, a, bounds)
+
+
+def kangaroo(curve, b, a, bounds, nwalks=KANGAROO_WALKS, dp_bits=None):
+    '''
+    Pollard's kangaroo method, parallel version of van Oorschot and Wiener with distinguished points.
+
+    Half of the `nwalks` walks (tame) start from known multiples of a in the middle of the interval,
+    the other half (wild) from b; each walk jumps by [2**i]a with i given by the x-coordinate of its point,
+    and all walks are advanced together so that their affine additions share one inversion.
+    Only the distinguished points (x-coordinate with `dp_bits` zero least significant bits) are kept,
+    and the same point reached by a tame walk and a wild walk gives the logarithm.
+    The memory does not depend on the size of the interval, but the method is probabilistic:
+    the logarithm is considered not to exist after KANGAROO_MAX_STEPS*sqrt(ub - lb) steps.
+    '''
+    lb, ub = bounds
+    if lb < 0 or ub < lb:
+        raise ValueError("kangaroo() requires 0<=lb<=ub")
+
+    width = ub - lb
+    if width < 2**16:   # use BSGS for small ranges
+        return bsgs(curve, b, a, bounds)
+
+    # c = b - [lb]a = [x]a with x in [0, width]
+    c = curve.add_aff(b, curve.neg(curve.mul(lb, a)))
+    if c == curve.infty:
+        return lb
+
+    p = curve.p
+    nwalks = max(2, nwalks)
+    kinds = [0]*(nwalks//2) + [1]*(nwalks - nwalks//2)   # 0: tame, 1: wild
+    sq = isqrt(width)
+
+    # jumps [2**i]a for 0 <= i < njumps, with a mean close to nwalks*sqrt(width)/4
+    mean = max(1, nwalks*sq//4)
+    njumps = 1
+    while (2**njumps - 1)//njumps < mean:
+        njumps += 1
+    jumps = [a]
+    for i in range(njumps - 1):
+        jumps.append(curve.dbl_aff(jumps[-1]))
+    jumps = [(J[0].a, J[1].a) for J in jumps]
+
+    # a walk meets a distinguished point every 2**dp_bits steps on average, a few times before a collision
+    if dp_bits is None:
+        dp_bits = max(0, (sq//(4*nwalks)).bit_length() - 1)
+    dp_mask = 2**dp_bits - 1
+
+    # starting points are reproducible for a given interval
+    rng = Random(width)
+
+    def start(kind):
+        if kind == 0:
+            d = width//2 + rng.randrange(mean)
+            P = curve.mul(d, a)
+        else:
+            d = rng.randrange(mean)
+            P = curve.add_aff(c, curve.mul(d, a))
+        return d, None if P == curve.infty else (P[0].a, P[1].a)
+
+    dists, points = [], []
+    for kind in kinds:
+        d, P = start(kind)
+        dists.append(d)
+        points.append(P)
+
+    dps = dict()    # x-coordinate of distinguished point -> (kind, distance, y-coordinate)
+    for it in range(KANGAROO_MAX_STEPS*(sq + 1)//nwalks + 1):
+        idx = [0 if P is None else (P[0] >> 32) % njumps for P in points]
+        invs = batch_invert([0 if P is None else jumps[i][0] - P[0] for P, i in zip(points, idx)], p)
+
+        for w in range(nwalks):
+            P = points[w]
+            jx, jy = jumps[idx[w]]
+            if P is None:
+                P = jx, jy
+            elif invs[w] != 0:
+                l = (jy - P[1])*invs[w] % p
+                x3 = (l*l - P[0] - jx) % p
+                P = x3, (l*(P[0] - x3) - P[1]) % p
+            else:   # P = +-[2**i]a
+                R = curve.add_aff((curve.field(P[0]), curve.field(P[1])), (curve.field(jx), curve.field(jy)))
+                P = None if R == curve.infty else (R[0].a, R[1].a)
+            points[w] = P
+            dists[w] += 2**idx[w]
+
+            if P is None or P[0] & dp_mask != 0:
+                continue
+
+            # distinguished point
+            other = dps.get(P[0])
+            if other is None:
+                dps[P[0]] = (kinds[w], dists[w], P[1])
+                continue
+
+            kind, d, y = other
+            if kind == kinds[w]:
+                if y == P[1]:   # this walk follows another one from now on: restart it
+                    dists[w], points[w] = start(kinds[w])
+                continue
+
+            dtame, dwild = (d, dists[w]) if kind == 0 else (dists[w], d)
+            if y == P[1]:   # [dtame]a = c + [dwild]a
+                x = dtame - dwild
+            else:           # [dtame]a = -(c + [dwild]a)
+                x = (-dtame - dwild) % curve.order
+            if 0 <= x <= width:
+                return lb + x
 
+    raise ValueError(f"Log of {b} to the base {a} not found in {bounds} by the kangaroo method.")
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+
+import json
+import mmap
+import os
+import struct
+
+from pydfa.ec import *
+
+# Files of the results of the analysis for the HNP solver (rows (u, v, L)), in two formats:
+#
+#  - text (CSV):
+#        <curve name>,<x-coordinate public key>,<y-coordinate public key>
+#        <u1>,<v1>,<L1>
+#        (...)
+#
+#  - binary (files ending with LEAK_EXTENSION), little-endian:
+#        magic (8 bytes, the last one is the version), length of header (4 bytes),
+#        header in JSON (curve, public key, skip, llambda, mode, size of the integers, provenance fields),
+#        padding to a multiple of 8 bytes,
+#        records of fixed size: u, v (signed), L on `width` bytes each, then 8 bytes for each provenance field
+#        (e.g. the index of the signature the row comes from)
+#
+# Both can be read while they are written: rows are flushed one by one and an incomplete last row is ignored.
+
+LEAK_MAGIC = b'DFAHNP\x00\x01'
+LEAK_EXTENSION = '.bin'
+
+
+def leak_width(curve):
+    '''Size in bytes of the integers u, v, L of a record (v can be negative and a bit larger than the order)'''
+    return curve.order.bit_length()//8 + 2
+
+
+def is_leak_file(filename):
+    '''True if `filename` is in the binary format'''
+    with open(filename, 'rb') as f:
+        return f.read(len(LEAK_MAGIC))[:-1] == LEAK_MAGIC[:-1]
+
+
+class CsvLeakWriter:
+    '''Writes rows (u, v, L) in the text format (provenance is not kept)'''
+
+    def __init__(self, filename, curve, pubkey, append=False):
+        if append and os.path.exists(filename):
+            self.f = open(filename, 'a')
+            return
+        self.f = open(filename, 'w')
+        # We only keep the curve name and the public key
+        self.f.write(f'{curve.name},{pubkey[0].hex()},{pubkey[1].hex()}\n')
+        self.f.flush()
+
+    def write(self, u, v, L, *provenance):
+        self.f.write(f'{u:x},{v:x},{L}\n')
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LeakWriter:
+    '''
+    Writes rows (u, v, L) in the binary format, with one value for each field of `provenance` per row.
+    With append=True and an existing file, rows are added at its end (the header must be the same).
+    '''
+
+    def __init__(self, filename, curve, pubkey, skip=None, llambda=None, mode=None, provenance=(), append=False):
+        self.width = leak_width(curve)
+        self.provenance = tuple(provenance)
+        header = {
+            'curve'     : curve.name,
+            'pubkey'    : [pubkey[0].hex(), pubkey[1].hex()],
+            'skip'      : skip,
+            'llambda'   : llambda,
+            'mode'      : mode,
+            'width'     : self.width,
+            'provenance': list(self.provenance)
+        }
+
+        if append and os.path.exists(filename):
+            leaks = LeakFile(filename)
+            if leaks.header != header:
+                raise ValueError(f'{filename} has another header, rows cannot be appended')
+            end = leaks.offset + len(leaks)*leaks.record_size
+            leaks.close()
+            self.f = open(filename, 'r+b')
+            self.f.truncate(end)        # incomplete last row
+            self.f.seek(end)
+            return
+
+        header = json.dumps(header).encode()
+        header += b' '*(-(len(LEAK_MAGIC) + 4 + len(header)) % 8)
+        self.f = open(filename, 'wb')
+        self.f.write(LEAK_MAGIC)
+        self.f.write(struct.pack('<I', len(header)))
+        self.f.write(header)
+        self.f.flush()
+
+    def write(self, u, v, L, *provenance):
+        w = self.width
+        record = u.to_bytes(w, 'little') + v.to_bytes(w, 'little', signed=True) + L.to_bytes(w, 'little')
+        record += struct.pack(f'<{len(self.provenance)}Q', *provenance)
+        self.f.write(record)
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def leak_writer(filename, curve, pubkey, skip=None, llambda=None, mode=None, provenance=(), append=False):
+    '''LeakWriter if `filename` ends with LEAK_EXTENSION, CsvLeakWriter otherwise'''
+    if filename.endswith(LEAK_EXTENSION):
+        return LeakWriter(filename, curve, pubkey, skip, llambda, mode, provenance, append)
+    return CsvLeakWriter(filename, curve, pubkey, append)
+
+
+class LeakFile:
+    '''
+    Memory-mapped file in the binary format: len() is the number of complete rows, leaks[i] is the row (u, v, L)
+    and leaks.provenance_of(i) the dictionary of its provenance fields.
+    refresh() maps the rows appended since the file was opened.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.mm = None
+        self.refresh()
+
+        if self.mm[:len(LEAK_MAGIC) - 1] != LEAK_MAGIC[:-1]:
+            raise ValueError(f'{filename} is not a file of leaks')
+        if self.mm[len(LEAK_MAGIC) - 1] != LEAK_MAGIC[-1]:
+            raise ValueError(f'{filename}: version {self.mm[len(LEAK_MAGIC) - 1]} of the format is not supported')
+
+        offset = len(LEAK_MAGIC) + 4
+        hlen, = struct.unpack('<I', self.mm[len(LEAK_MAGIC):offset])
+        self.header = json.loads(self.mm[offset:offset + hlen].decode())
+        self.offset = offset + hlen
+
+        self.curve = CurveJac(CURVES[self.header['curve']])
+        self.pubkey = tuple(self.curve.field(int(x, 16)) for x in self.header['pubkey'])
+        self.skip = self.header['skip']
+        self.llambda = self.header['llambda']
+        self.mode = self.header['mode']
+        self.width = self.header['width']
+        self.provenance = tuple(self.header['provenance'])
+        self.record_size = 3*self.width + 8*len(self.provenance)
+
+    def refresh(self):
+        with open(self.filename, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if self.mm is not None and len(self.mm) == size:
+                return
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.close()
+        self.mm = mm
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+    def __len__(self):
+        return max(0, (len(self.mm) - self.offset)//self.record_size)
+
+    def _record(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError('row index out of range')
+        start = self.offset + i*self.record_size
+        return memoryview(self.mm)[start:start + self.record_size]
+
+    def __getitem__(self, i):
+        w = self.width
+        record = self._record(i)
+        u = int.from_bytes(record[:w], 'little')
+        v = int.from_bytes(record[w:2*w], 'little', signed=True)
+        L = int.from_bytes(record[2*w:3*w], 'little')
+        record.release()
+        return u, v, L
+
+    def provenance_of(self, i):
+        record = self._record(i)
+        values = struct.unpack_from(f'<{len(self.provenance)}Q', record, 3*self.width)
+        record.release()
+        return dict(zip(self.provenance, values))
+
+    def rows(self):
+        '''Returns the lists Ui, Vi, Li of all the complete rows'''
+        Ui, Vi, Li = [], [], []
+        for i in range(len(self)):
+            u, v, L = self[i]
+            Ui.append(u)
+            Vi.append(v)
+            Li.append(L)
+        return Ui, Vi, Li
+
+
+def load_csv(filename):
+    '''Returns curve, pubkey, Ui, Vi, Li from a file in the text format'''
+
+    f = open(filename, 'r')
+
+    line = f.readline()
+    sp = line.strip().split(',')
+    curve_name = sp[0]
+    curve = CurveJac(CURVES[curve_name])
+    pubkey = curve.field(int(sp[1], 16)), curve.field(int(sp[2], 16))
+
+    Ui, Vi, Li = [], [], []
+
+    line = f.readline()
+    # the last line can be incomplete if the file is still being written
+    while line.endswith('\n'):
+        sp = line.strip().split(',')
+        Ui.append(int(sp[0],16))
+        Vi.append(int(sp[1],16))
+        Li.append(int(sp[2]))
+        line = f.readline()
+
+    f.close()
+
+    return curve, pubkey, Ui, Vi, Li
+
+
+def load_leaks(filename):
+    '''Returns curve, pubkey, Ui, Vi, Li from a file in any of the two formats'''
+    if not is_leak_file(filename):
+        return load_csv(filename)
+
+    leaks = LeakFile(filename)
+    Ui, Vi, Li = leaks.rows()
+    curve, pubkey = leaks.curve, leaks.pubkey
+    leaks.close()
+    return curve, pubkey, Ui, Vi, Li
+
+
+def export_csv(filename, csv_filename):
+    '''Writes the rows of a file in the binary format in `csv_filename` (text format)'''
+    curve, pubkey, Ui, Vi, Li = load_leaks(filename)
+    with CsvLeakWriter(csv_filename, curve, pubkey) as f:
+        for u, v, L in zip(Ui, Vi, Li):
+            f.write(u, v, L)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+
+from pydfa.ec import *
+from pydfa import dfa_dl
+
+# state of a worker process, set once by _init_worker
+_worker = dict()
+
+
+def _init_worker(curve_type, params, arith, pubkey, table_dir, dlog_method):
+    '''The curve is rebuilt from its parameters once per worker'''
+    curve = curve_type(params, arith)
+    _worker['curve'] = curve
+    _worker['pubkey'] = None if pubkey is None else (curve.field(pubkey[0]), curve.field(pubkey[1]))
+    dfa_dl.set_table_dir(table_dir)
+    dfa_dl.set_dlog_method(dlog_method)
+
+
+def _leak_from_chunk(task):
+    leak_func, args, batch, chunk = task
+    return list(_leaks(_worker['curve'], _worker['pubkey'], chunk, leak_func, args, batch))
+
+
+def _leaks(curve, pubkey, chunk, leak_func, args, batch):
+    points = points_from_sigs(curve, pubkey, chunk)
+    if not batch:
+        return ((valid, leak_func(curve, Q, QQ_list, *args)) for valid, Q, QQ_list in points)
+    leaks = leak_func(curve, [(Q, QQ_list) for valid, Q, QQ_list in points], *args)
+    return ((valid, leak) for (valid, Q, QQ_list), leak in zip(points, leaks))
+
+
+def _apply_chunk(task):
+    func, args, chunk = task
+    curve = _worker['curve']
+    return [func(curve, *item, *args) for item in chunk]
+
+
+def chunks(items, chunksize):
+    '''Splits any iterable in lists of `chunksize` items (the last one may be shorter)'''
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, chunksize))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+
+def _imap(pool, func, tasks, window, ordered=True):
+    '''
+    Same as pool.imap (or pool.imap_unordered), but with at most `window` tasks submitted and not yet consumed,
+    so that `tasks` is consumed lazily and memory is bounded
+    '''
+    tasks = iter(tasks)
+    pending = deque()
+    for task in islice(tasks, window):
+        pending.append(pool.apply_async(func, (task,)))
+
+    while len(pending) > 0:
+        if ordered:
+            res = pending.popleft()
+        else:
+            res = next((res for res in pending if res.ready()), None)
+            if res is None:
+                pending[0].wait(0.01)
+                continue
+            pending.remove(res)
+
+        out = res.get()
+        for task in islice(tasks, 1):
+            pending.append(pool.apply_async(func, (task,)))
+        yield out
+
+
+def _pool(curve, pubkey, jobs):
+    pubkey = None if pubkey is None else (pubkey[0].to_int(), pubkey[1].to_int())
+    initargs = (type(curve), curve.params, curve.arith, pubkey, dfa_dl.TABLE_DIR, dfa_dl.DLOG_METHOD)
+    return Pool(jobs, initializer=_init_worker, initargs=initargs)
+
+
+def leak_from_sigs(curve, pubkey, list_sig, leak_func, args=(), jobs=1, chunksize=8, batch=False):
+    '''
+    Yields (valid, leak_func(curve, Q, QQ_list, *args)) for each signature (msg, r, s) of `list_sig`, in order.
+    With batch=True, leak_func(curve, list_points, *args) analyses the points (Q, QQ_list) of a whole chunk
+    of signatures and returns the list of their leaks.
+    With jobs > 1, chunks of signatures are verified and analysed by a pool of `jobs` processes.
+    `list_sig` can be any iterable, it is consumed lazily.
+    '''
+    if jobs <= 1:
+        for chunk in chunks(list_sig, chunksize):
+            yield from _leaks(curve, pubkey, chunk, leak_func, args, batch)
+        return
+
+    tasks = ((leak_func, args, batch, chunk) for chunk in chunks(list_sig, chunksize))
+    with _pool(curve, pubkey, jobs) as pool:
+        for res in _imap(pool, _leak_from_chunk, tasks, 2*jobs):
+            yield from res
+
+
+def parallel_map(curve, func, items, args=(), jobs=1, chunksize=8, ordered=True):
+    '''
+    Yields func(curve, *item, *args) for each tuple `item` of `items` with `jobs` processes,
+    in order or, with ordered=False, as soon as each chunk is completed.
+    `items` can be any iterable, it is consumed lazily.
+    '''
+    if jobs <= 1:
+        for item in items:
+            yield func(curve, *item, *args)
+        return
+
+    tasks = ((func, args, chunk) for chunk in chunks(items, chunksize))
+    with _pool(curve, None, jobs) as pool:
+        for res in _imap(pool, _apply_chunk, tasks, 2*jobs, ordered):
+            yield from res
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+from collections import deque
+
+from pydfa.dfa_analysis import *
+from pydfa.dfa_leakfile import leak_writer
+
+# Streaming analysis of faulty signatures:
+#
+#     signatures -> verification, candidate points, discrete logarithms -> rows for HNP -> file
+#
+# Each stage is a generator consuming the previous one, so that only a bounded number of signatures
+# is in memory at any time and the rows are written to the file as soon as they are computed
+# (the file can be used by solve_hnp.py while the analysis is running).
+
+
+def sign_stage(curve, privkey, mode, nsig, skip=-1, llambda=20, seed=None, jobs=1):
+    '''Yields the faulty signatures (msg, r, s) of the simulation, in order'''
+    yield from simulation_ecdsa_parallel(curve, privkey, mode, nsig, skip, llambda, seed=seed, jobs=jobs, ordered=True)
+
+
+def dlp_stage(curve, pubkey, sigs, mode, skip, llambda=None, jobs=1, ctx=None):
+    '''
+    Yields (msg, r, s, valid, leak) for each signature: verification, computation of the candidate points
+    and of the discrete logarithms of the analysis given by `mode` (see ANALYSIS_MODE)
+    '''
+    # signatures submitted to the analysis and not yet returned
+    pending = deque()
+
+    def submit():
+        for sig in sigs:
+            pending.append(sig)
+            yield sig
+
+    for valid, leak in analysis_leaks(curve, pubkey, submit(), mode, skip, llambda, jobs, ctx):
+        msg, r, s = pending.popleft()
+        yield msg, r, s, valid, leak
+
+
+def hnp_stage(curve, records, mode, skip, llambda=None, total=None):
+    '''Prints the result of the analysis of each signature and yields the rows (u, v, L) for HNP'''
+    hnp_row = ANALYSIS_MODE[mode][1]
+    for i, (msg, r, s, valid, leak) in enumerate(records):
+        text, row = hnp_row(curve, msg, r, s, valid, leak, skip, llambda)
+        print(f'Signature {i + 1}/{"?" if total is None else total}: {text}')
+        if row is not None:
+            yield row
+
+
+def append_stage(curve, pubkey, rows, filename, skip=None, llambda=None, mode=None):
+    '''
+    Writes the rows (u, v, L) in `filename` (binary or text format of solve_hnp.py, see dfa_leakfile)
+    as soon as they arrive and yields them
+    '''
+    with leak_writer(filename, curve, pubkey, skip, llambda, mode) as f:
+        for u, v, L in rows:
+            f.write(u, v, L)
+            yield u, v, L
+
+
+def analysis_pipeline(curve, pubkey, sigs, mode, skip, llambda=None, filename=None, jobs=1, total=None, ctx=None):
+    '''Chains the stages of the analysis of the signatures `sigs` and yields the rows for HNP'''
+    records = dlp_stage(curve, pubkey, sigs, mode, skip, llambda, jobs, ctx)
+    rows = hnp_stage(curve, records, mode, skip, llambda, total)
+    if filename is not None:
+        rows = append_stage(curve, pubkey, rows, filename, skip, llambda, mode)
+    return rows
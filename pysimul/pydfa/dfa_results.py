@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+from hashlib import sha256
+import json
+import sqlite3
+
+# Results of fault campaigns (emulation with Unicorn, signatures of the GDB attack) in a SQLite database:
+#
+#   campaigns(campaign, params)   one row per campaign, `params` in JSON, `campaign` a hash of them
+#   results(campaign, position, fault, instruction, x, y, on_curve, candidates, nbits, lsb, truth, correct,
+#           status, time, error)
+#
+# The rows are only appended (a row with the same campaign, position and fault as an existing one is ignored)
+# and committed by batches of BATCH_COMMIT, so that a campaign that was interrupted can be resumed
+# by skipping the positions already done (see ResultStore.done). Large integers (coordinates, bits of the
+# scalar) are stored in hexadecimal.
+#
+# Example of query, the faults that gave the expected bits:
+#     sqlite3 results.db "SELECT position, fault, instruction FROM results WHERE correct = 1"
+
+BATCH_COMMIT = 256
+
+RESULT_COLUMNS = ('campaign', 'position', 'fault', 'instruction', 'x', 'y', 'on_curve', 'candidates', 'nbits', 'lsb',
+                  'truth', 'correct', 'status', 'time', 'error')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS campaigns (
+    campaign    TEXT PRIMARY KEY,
+    params      TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    campaign    TEXT,
+    position    INTEGER,
+    fault       TEXT NOT NULL,
+    instruction TEXT,
+    x           TEXT,
+    y           TEXT,
+    on_curve    INTEGER,
+    candidates  INTEGER,
+    nbits       INTEGER,
+    lsb         TEXT,
+    truth       TEXT,
+    correct     INTEGER,
+    status      TEXT,
+    time        REAL,
+    error       TEXT,
+    UNIQUE (campaign, position, fault)
+);
+'''
+
+
+def campaign_id(params):
+    '''Identifier of a campaign: hash of its parameters (dictionary)'''
+    return sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def _hex(value):
+    return None if value is None else f'{value:x}'
+
+
+class ResultStore:
+    '''
+    Database of results opened for the campaign with the parameters `params` (dictionary, e.g. binary, scalar,
+    steps of the fault): rows are added with `append` and committed every `batch` rows and by `close`
+    '''
+
+    def __init__(self, filename, params, batch=BATCH_COMMIT):
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.executescript(_SCHEMA)
+        self.campaign = campaign_id(params)
+        self.db.execute('INSERT OR IGNORE INTO campaigns VALUES (?, ?)',
+                        (self.campaign, json.dumps(params, sort_keys=True)))
+        self.db.commit()
+        self.batch = batch
+        self.pending = 0
+
+    def done(self):
+        '''Set of the (position, fault) already stored for the campaign'''
+        cur = self.db.execute('SELECT position, fault FROM results WHERE campaign = ?', (self.campaign,))
+        return set(cur.fetchall())
+
+    def append(self, position, fault, instruction=None, x=None, y=None, on_curve=None, candidates=None,
+               nbits=None, lsb=None, truth=None, status=None, time=None, error=None):
+        '''
+        Adds the result of a fault (x, y, lsb and truth as integers, truth is the expected value of lsb),
+        `fault` must be given (rows are unique per campaign, position and fault)
+        '''
+        # INSERT OR IGNORE would silently drop a row without fault
+        if fault is None:
+            raise ValueError('the fault of a result must be given')
+        correct = None if lsb is None or truth is None else int(lsb == truth)
+        row = (self.campaign, position, fault, None if instruction is None else str(instruction),
+               _hex(x), _hex(y), None if on_curve is None else int(on_curve), candidates,
+               nbits, _hex(lsb), _hex(truth), correct, status, time, error)
+        self.db.execute(f'INSERT OR IGNORE INTO results VALUES ({", ".join("?"*len(RESULT_COLUMNS))})', row)
+        self.pending += 1
+        if self.pending >= self.batch:
+            self.commit()
+
+    def commit(self):
+        self.db.commit()
+        self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def query(filename, sql, args=()):
+    '''Returns the rows of a query on a database of results as dictionaries'''
+    db = sqlite3.connect(filename)
+    db.row_factory = sqlite3.Row
+    rows = [dict(row) for row in db.execute(sql, args)]
+    db.close()
+    return rows
+
+
+def campaign_results(filename, params):
+    '''Returns the results of the campaign with the parameters `params` in order of position'''
+    return query(filename, 'SELECT * FROM results WHERE campaign = ? ORDER BY position, rowid', (campaign_id(params),))
@@ -5,7 +5,35 @@ from random import randint
 # FLT inversion when m is prime
 invmod = lambda a, m : pow(a, m - 2, m)
 
+# inversion with the extended Euclidean algorithm (Python >= 3.8), used by the 'int' backend
+invmod_int = lambda a, m : pow(a, -1, m)
+
+def batch_invert(values, m):
+    '''
+    Montgomery's simultaneous inversion: inverses of all `values` mod m with a single modular inversion
+    (zero values are left to zero)
+    '''
+    values = [a % m for a in values]
+    prefix = []
+    acc = 1
+    for a in values:
+        prefix.append(acc)
+        if a != 0:
+            acc = acc*a % m
+
+    inv = invmod_int(acc, m)
+    res = [0]*len(values)
+    for i in range(len(values) - 1, -1, -1):
+        a = values[i]
+        if a != 0:
+            res[i] = inv*prefix[i] % m
+            inv = inv*a % m
+    return res
+
+
 class FieldElement:
+    __slots__ = ('field', 'a')
+
     def __init__(self, a, field):
         self.field = field
         self.a = a % self.field.p
@@ -123,6 +151,22 @@ class PrimeField:
         return FieldElement(a, self)
 
 
+def wnaf(k, w):
+    '''Width-w NAF of k >= 0: list of digits, least significant first, odd digits in (-2**(w-1), 2**(w-1))'''
+    digits = []
+    while k > 0:
+        if k & 1:
+            d = k & (2**w - 1)
+            if d >= 2**(w - 1):
+                d -= 2**w
+            k -= d
+        else:
+            d = 0
+        digits.append(d)
+        k >>= 1
+    return digits
+
+
 def conditional_swap(bit, R0, R1):
     if bit == 1:
         R0, R1 = R1, R0
@@ -130,7 +174,11 @@ def conditional_swap(bit, R0, R1):
 
 
 class Curve:
-    def __init__(self, params):
+    def __init__(self, params, arith='int'):
+        if arith not in ARITH_BACKENDS:
+            raise ValueError(f'Unknown arithmetic backend {arith}, choose amongst: {ARITH_BACKENDS}')
+        self.params = params
+        self.arith = arith
         self.name = params['name']
         self.field = PrimeField(params['p'])
         self.A = self.field(params['A'])
@@ -138,6 +186,16 @@ class Curve:
         self.order = params['order']
         self.base = self.field(params['x0']), self.field(params['y0'])
 
+        # raw integer constants for the 'int' backend
+        # (A is kept signed so that a small A keeps products small)
+        self.p = params['p']
+        self._A = self.A.a if self.A.a <= self.p//2 else self.A.a - self.p
+        self._B = self.B.a
+
+        # fixed-base tables of the base point, built at the first use (see _base_table_int and _odd_multiples_int)
+        self._base_table = None
+        self._base_odd_multiples = None
+
     def is_on_curve(self, P):
         x = self.field(P[0])
         y = self.field(P[1])
@@ -187,6 +245,8 @@ class Curve:
         '''https://hyperelliptic.org/EFD/g1p/auto-shortw-projective.html#doubling-mdbl-2007-bl'''
         if P == self.infty:
             return P
+        if self.arith == 'int':
+            return self._dbl_aff_int(P[0].a, P[1].a)
 
         X1, Y1 = P
         
@@ -223,6 +283,9 @@ class Curve:
         if Q == self.infty:
             return P
                 
+        if self.arith == 'int':
+            return self._add_aff_int(P[0].a, P[1].a, Q[0].a, Q[1].a)
+
         X1, Y1 = P
         X2, Y2 = Q
 
@@ -250,11 +313,256 @@ class Curve:
         t = Z3**-1        
         return X3*t, Y3*t
 
+    ## 'int' backend: formulas on raw integers
+    ## only products are reduced, sums and differences are left for the next product
+
+    def _dbl_aff_int(self, x1, y1):
+        p = self.p
+        if y1 == 0:
+            raise ZeroDivisionError
+        l = (3*x1*x1 + self._A)*invmod_int(2*y1 % p, p) % p
+        x3 = (l*l - 2*x1) % p
+        y3 = (l*(x1 - x3) - y1) % p
+        return self.field(x3), self.field(y3)
+
+    def _add_aff_int(self, x1, y1, x2, y2):
+        p = self.p
+        if x1 == x2:
+            if y1 == y2:
+                return self._dbl_aff_int(x1, y1)
+            return self.infty
+        l = (y2 - y1)*invmod_int((x2 - x1) % p, p) % p
+        x3 = (l*l - x1 - x2) % p
+        y3 = (l*(x1 - x3) - y1) % p
+        return self.field(x3), self.field(y3)
+
+    def _add_jac_int(self, P1, P2):
+        '''add-2007-bl on raw integers (see CurveJac.add_jac)'''
+        p = self.p
+        X1, Y1, Z1 = P1
+        X2, Y2, Z2 = P2
+
+        if Z1 % p == 0:
+            return P2
+        if Z2 % p == 0:
+            return P1
+
+        Z1Z1 = Z1*Z1 % p
+        Z2Z2 = Z2*Z2 % p
+        U1 = X1*Z2Z2 % p
+        U2 = X2*Z1Z1 % p
+        S1 = Y1*Z2*Z2Z2 % p
+        S2 = Y2*Z1*Z1Z1 % p
+        H = U2 - U1
+        t3 = S2 - S1
+        if H % p == 0:
+            if t3 % p == 0:
+                return self._dbl_jac_int(P1)
+            return 1, 1, 0
+        I = 4*H*H % p
+        J = H*I % p
+        r = 2*t3
+        V = U1*I % p
+        X3 = r*r % p - J - 2*V
+        Y3 = r*(V - X3) % p - 2*S1*J % p
+        Z3 = ((Z1 + Z2)**2 - Z1Z1 - Z2Z2)*H % p
+        return X3, Y3, Z3
+
+    def _dbl_jac_int(self, P1):
+        '''dbl-2007-bl on raw integers (see CurveJac.dbl_jac)'''
+        p = self.p
+        X1, Y1, Z1 = P1
+        if Z1 % p == 0:
+            return P1
+
+        XX = X1*X1 % p
+        YY = Y1*Y1 % p
+        YYYY = YY*YY % p
+        ZZ = Z1*Z1 % p
+        S = 2*((X1 + YY)**2 % p - XX - YYYY)
+        M = 3*XX + self._A*(ZZ*ZZ % p)
+        T = M*M % p - 2*S
+        X3 = T
+        Y3 = M*(S - T) % p - 8*YYYY
+        Z3 = (Y1 + Z1)**2 % p - YY - ZZ
+        return X3, Y3, Z3
+
+    def _madd_jac_int(self, P1, x2, y2):
+        '''madd-2007-bl on raw integers: P1 in Jacobian coordinates and (x2, y2) affine'''
+        p = self.p
+        X1, Y1, Z1 = P1
+
+        if Z1 % p == 0:
+            return x2, y2, 1
+
+        Z1Z1 = Z1*Z1 % p
+        U2 = x2*Z1Z1 % p
+        S2 = y2*Z1*Z1Z1 % p
+        H = U2 - X1
+        t = S2 - Y1
+        if H % p == 0:
+            if t % p == 0:
+                return self._dbl_jac_int(P1)
+            return 1, 1, 0
+        HH = H*H % p
+        I = 4*HH
+        J = H*I % p
+        r = 2*t
+        V = X1*I % p
+        X3 = r*r % p - J - 2*V
+        Y3 = r*(V - X3) % p - 2*Y1*J % p
+        Z3 = (Z1 + H)**2 % p - Z1Z1 - HH
+        return X3, Y3, Z3
+
+    def _jac_to_affine_int(self, P):
+        p = self.p
+        X, Y, Z = P
+        if Z % p == 0:
+            return self.infty
+        tcub = invmod_int(Z % p, p)
+        tsqr = tcub*tcub % p
+        return self.field(X*tsqr), self.field(Y*tsqr*tcub)
+
+    def _jac_to_affine_batch_int(self, points):
+        '''same as _jac_to_affine_int on a list of points, with one inversion for the whole list'''
+        p = self.p
+        res = []
+        for (X, Y, Z), tcub in zip(points, batch_invert([P[2] for P in points], p)):
+            if tcub == 0:
+                res.append(self.infty)
+                continue
+            tsqr = tcub*tcub % p
+            res.append((self.field(X*tsqr), self.field(Y*tsqr*tcub)))
+        return res
+
+    def _base_table_int(self):
+        '''
+        Fixed-base table of the base point G, built once per curve: with w = BASE_WINDOW,
+        row j holds the affine points [d*2**(w*j)]G for 0 < d < 2**w (raw integers, index 0 unused)
+        '''
+        if self._base_table is None:
+            self._base_table = self._window_table_int(self.base, BASE_WINDOW)
+        return self._base_table
+
+    def _window_table_int(self, P, w):
+        '''Fixed-point table of P: row j holds the affine points [d*2**(w*j)]P for 0 < d < 2**w (raw integers, index 0 unused)'''
+        nrows = (self.order.bit_length() + w - 1)//w
+        points = []
+        x, y = P[0].a, P[1].a
+        for j in range(nrows):
+            R = x, y, 1
+            for d in range(1, 2**w):
+                points.append(R)
+                R = self._madd_jac_int(R, x, y)
+            x, y = self._jac_to_affine_int(R)  # [2**(w*(j + 1))]P
+            x, y = x.a, y.a
+
+        points = [(x.a, y.a) for x, y in self._jac_to_affine_batch_int(points)]
+        return [[None] + points[j*(2**w - 1):(j + 1)*(2**w - 1)] for j in range(nrows)]
+
+    def _mul_base_jac_int(self, k):
+        '''[k]G for the base point G in Jacobian coordinates on raw integers, one addition per window of k (not faultable)'''
+        return self._mul_window_jac_int(self._base_table_int(), BASE_WINDOW, k)
+
+    def _mul_window_jac_int(self, table, w, k):
+        '''[k]P in Jacobian coordinates on raw integers with the table of P given by _window_table_int(P, w)'''
+        mask = 2**w - 1
+        k %= self.order
+        R = 1, 1, 0
+        j = 0
+        while k != 0:
+            d = k & mask
+            if d != 0:
+                R = self._madd_jac_int(R, *table[j][d])
+            k >>= w
+            j += 1
+        return R
+
+    def _odd_multiples_int(self, P, w):
+        '''Affine points [d]P for d = 1, 3, ..., 2**(w-1) - 1 (raw integers), normalised with one inversion'''
+        x, y = P[0].a, P[1].a
+        points = [(x, y, 1)]
+        if w > 2:
+            x2, y2 = self._jac_to_affine_int(self._dbl_jac_int((x, y, 1)))
+            for i in range(2**(w - 2) - 1):
+                points.append(self._madd_jac_int(points[-1], x2.a, y2.a))
+        return [(x.a, y.a) for x, y in self._jac_to_affine_batch_int(points)]
+
+    def _mul_double_jac_int(self, u, v, P):
+        '''
+        [u]G + [v]P for the base point G in Jacobian coordinates on raw integers (not faultable):
+        Strauss-Shamir interleaving of the wNAF of u and v, sharing the doublings,
+        with the odd multiples of G computed once per curve
+        '''
+        p = self.p
+        if self._base_odd_multiples is None:
+            self._base_odd_multiples = self._odd_multiples_int(self.base, BASE_WNAF)
+        tables = [self._base_odd_multiples]
+        digits = [wnaf(u % self.order, BASE_WNAF)]
+        if v % self.order != 0 and P != self.infty:
+            tables.append(self._odd_multiples_int(P, POINT_WNAF))
+            digits.append(wnaf(v % self.order, POINT_WNAF))
+
+        R = 1, 1, 0
+        for i in range(max(len(n) for n in digits) - 1, -1, -1):
+            R = self._dbl_jac_int(R)
+            for table, n in zip(tables, digits):
+                if i < len(n) and n[i] != 0:
+                    d = n[i]
+                    if d > 0:
+                        x, y = table[d >> 1]
+                        R = self._madd_jac_int(R, x, y)
+                    else:
+                        x, y = table[-d >> 1]
+                        R = self._madd_jac_int(R, x, p - y)
+        return R
+
+    def mul_base(self, k):
+        '''[k]G for the base point G with the fixed-base table (not faultable, use ladder for the simulation of a fault)'''
+        return self._jac_to_affine_int(self._mul_base_jac_int(k))
+
+    def mul_many(self, P, scalars):
+        '''
+        Returns the list of the affine points [k]P for the integers k of `scalars` (same as self.mul for each k):
+        the windows of the scalars share a table of P (see _window_table_int) and the results share one inversion
+        '''
+        if P == self.infty:
+            return [self.infty for k in scalars]
+        table = self._window_table_int(P, MANY_WINDOW)
+        return self._jac_to_affine_batch_int([self._mul_window_jac_int(table, MANY_WINDOW, k) for k in scalars])
+
+    def mul(self, k, P):
+        '''[k]P without fault, with the fixed-base table when P is the base point'''
+        if P == self.base:
+            return self.mul_base(k)
+        return self.ladder(k, P)
+
+    def multiples(self, P, n, Q=None, batch_size=1024):
+        '''
+        Yields the affine points Q + [i]P for i in range(n) (Q is the point at infinity by default).
+        Points are computed in Jacobian coordinates and normalised with one inversion per batch.
+        '''
+        x, y = P[0].a, P[1].a
+        if Q is None or Q == self.infty:
+            R = 1, 1, 0
+        else:
+            R = Q[0].a, Q[1].a, 1
+
+        batch = []
+        for i in range(n):
+            batch.append(R)
+            if len(batch) == batch_size:
+                yield from self._jac_to_affine_batch_int(batch)
+                batch = []
+            if i != n - 1:
+                R = self._madd_jac_int(R, x, y)
+        yield from self._jac_to_affine_batch_int(batch)
+
 
 class CurveJac(Curve):
 
-    def __init__(self, params):
-        Curve.__init__(self, params)
+    def __init__(self, params, arith='int'):
+        Curve.__init__(self, params, arith)
         self.type = 'Jac'
         self.infty = self.field(1), self.field(1), self.field(0)
      
@@ -266,6 +574,10 @@ class CurveJac(Curve):
         tsqr = tcub**2
         tcub = tsqr*tcub
         return X*tsqr, Y*tcub
+
+    def to_affine_batch(self, points):
+        '''same as to_affine on a list of points, with one inversion for the whole list'''
+        return self._jac_to_affine_batch_int([(X.a, Y.a, Z.a) for X, Y, Z in points])
  
     def add_jac(self, P1, P2):
         '''https://hyperelliptic.org/EFD/g1p/auto-shortw-jacobian.html#addition-add-2007-bl'''
@@ -354,6 +666,8 @@ class CurveJac(Curve):
             return self.infty
         if k == 1:
             return P
+        if self.arith == 'int':
+            return self._ladder_int(k, P, skip)
         
         n = k.bit_length()
         R0 = P[0], P[1], self.field(1)
@@ -372,11 +686,30 @@ class CurveJac(Curve):
 
         return self.to_affine(R0)
 
+    def _ladder_int(self, k, P, skip=-1):
+        '''same as ladder, with the 'int' backend'''
+        n = k.bit_length()
+        R0 = P[0].a, P[1].a, 1
+        R1 = self._dbl_jac_int(R0)
+
+        condition = 0
+        for i in range(n - 2, -1, -1):
+            ki = (k >> i) & 1
+            condition ^= ki
+            R0, R1 = conditional_swap(condition, R0, R1)
+            R1 = self._add_jac_int(R0, R1)
+            R0 = self._dbl_jac_int(R0)
+            if i != skip: condition = ki # fault on step "skip"
+
+        R0, R1 = conditional_swap(k & 1, R0, R1)
+
+        return self._jac_to_affine_int(R0)
+
 
 class CurveXZ(Curve):
 
-    def __init__(self, params):
-        Curve.__init__(self, params)
+    def __init__(self, params, arith='int'):
+        Curve.__init__(self, params, arith)
         self.typ = 'XZ'
         self.B2 = self.B*2
         self.B4 = self.B2*2
@@ -387,6 +720,16 @@ class CurveXZ(Curve):
             return self.infty
         t = P[2]**-1
         return P[0]*t, P[1]*t
+
+    def to_affine_batch(self, points):
+        '''same as to_affine on a list of points, with one inversion for the whole list'''
+        res = []
+        for (X, Y, Z), t in zip(points, batch_invert([P[2].a for P in points], self.p)):
+            if t == 0:
+                res.append(self.infty)
+                continue
+            res.append((X*t, Y*t))
+        return res
     
     def y_recovery(self, P, R0, R1):
 
@@ -473,6 +816,8 @@ class CurveXZ(Curve):
             return self.infty
         if k == 1:
             return P
+        if self.arith == 'int':
+            return self._ladder_int(k, P, skip)
         
         n = k.bit_length()
         R0 = P[0], self.field(1)
@@ -491,11 +836,82 @@ class CurveXZ(Curve):
         
         return self.to_affine(R)
 
+    def _y_recovery_int(self, P, R0, R1):
+        p = self.p
+        x0, y0 = P
+        X1, Z1 = R0
+        X2, Z2 = R1
+        A = x0*Z1 % p
+        B = (A - X1)**2 % p
+        C = x0*X1 % p
+        D = self._A*Z1
+        A = (A + X1)*(C + D) % p
+        C = Z1*Z2 % p
+        D = 2*y0*C % p
+        C = self._B*2*C % p
+        X = D*X1 % p
+        Z = D*Z1 % p
+        Y = A*Z2 % p - B*X2 % p + C*Z1 % p
+        return X, Y, Z
+
+    def _add_xz_int(self, P1, P2, x0):
+        '''diffadd-mdadd-2002-it-4 on raw integers (see add_xz)'''
+        p = self.p
+        X1, Z1 = P1
+        X2, Z2 = P2
+
+        T1 = X1*X2 % p
+        T2 = Z1*Z2 % p
+        T3 = X1*Z2 % p
+        T4 = X2*Z1 % p
+        T8 = (T3 + T4)*(T1 + self._A*T2) % p
+        T12 = 4*self._B*(T2*T2 % p) % p
+        Z3 = (T3 - T4)**2 % p
+        X3 = 2*T8 + T12 - x0*Z3 % p
+        return X3, Z3
+
+    def _dbl_xz_int(self, P1):
+        '''dbl-2002-bj-3 on raw integers (see dbl_xz)'''
+        p = self.p
+        X1, Z1 = P1
+
+        XX = X1*X1 % p
+        ZZ = Z1*Z1 % p
+        A = 2*((X1 + Z1)**2 % p - XX - ZZ)
+        aZZ = self._A*ZZ
+        X3 = (XX - aZZ)**2 % p - 2*self._B*(A*ZZ % p) % p
+        Z3 = A*(XX + aZZ) % p + 4*self._B*(ZZ*ZZ % p) % p
+        return X3, Z3
+
+    def _ladder_int(self, k, P, skip=-1):
+        '''same as ladder, with the 'int' backend'''
+        p = self.p
+        n = k.bit_length()
+        x0 = P[0].a
+        R0 = x0, 1
+        R1 = self._dbl_xz_int(R0)
+
+        condition = 0
+        for i in range(n - 2, -1, -1):
+            ki = (k >> i) & 1
+            condition ^= ki
+            R0, R1 = conditional_swap(condition, R0, R1)
+            R1 = self._add_xz_int(R0, R1, x0)
+            R0 = self._dbl_xz_int(R0)
+            if i != skip: condition = ki # fault on step "skip"
+        R0, R1 = conditional_swap(k & 1, R0, R1)
+        X, Y, Z = self._y_recovery_int((x0, P[1].a), R0, R1)
+
+        if Z % p == 0:
+            return self.infty
+        t = invmod_int(Z % p, p)
+        return self.field(X*t), self.field(Y*t)
+
     
 class CurveCoZ(Curve):
 
-    def __init__(self, params):
-        Curve.__init__(self, params)
+    def __init__(self, params, arith='int'):
+        Curve.__init__(self, params, arith)
         self.type = 'CoZ'
         self.infty = self.field(1), self.field(1), self.field(0)
         
@@ -603,6 +1019,8 @@ class CurveCoZ(Curve):
             return self.infty
         if k == 1:
             return P
+        if self.arith == 'int':
+            return self._ladder_int(k, P, skip)
         
         x, y = P
         R1, R0 = self.XYCZdblJac((x, y, self.field(1)))
@@ -628,6 +1046,99 @@ class CurveCoZ(Curve):
         X, Y = R0
         return X*lambdaX, Y*lambdaY
 
+    def _Z_recovery_int(self, bit, P, R0, R1):
+        p = self.p
+        x, y = P
+        X0 = R0[0]
+        X1, Y1 = R1
+        t = (X1 - X0)*Y1 % p
+        t = t*x % p
+        if t == 0:
+            raise ZeroDivisionError
+        t = invmod_int(t, p)
+        u = X1*y % p
+        if bit == 0:
+            u = -u
+        t = u*t % p
+        lambdaX = t*t % p
+        lambdaY = t*lambdaX % p
+        return lambdaX, lambdaY
+
+    def _XYCZadd_int(self, P1, P2):
+        '''XYCZadd on raw integers'''
+        p = self.p
+        X1, Y1 = P1
+        X2, Y2 = P2
+
+        A = (X2 - X1)**2 % p
+        B = X2*A % p
+        C = X1*A % p
+        D = Y2 - Y1
+        X3 = D*D % p - C - B
+        Y1 = Y1*(B - C) % p
+        Y3 = D*(C - X3) % p - Y1
+        return (X3, Y3), (C, Y1)
+
+    def _XYCZaddC_int(self, P1, P2):
+        '''XYCZaddC on raw integers'''
+        p = self.p
+        X1, Y1 = P1
+        X2, Y2 = P2
+
+        A = (X2 - X1)**2 % p
+        B = X1*A % p
+        C = X2*A % p
+        E = Y2 + Y1
+        F = Y2 - Y1
+        G = Y1*(C - B) % p
+        BC = C + B
+        X3 = F*F % p - BC
+        Y3 = F*(B - X3) % p - G
+        X4 = E*E % p - BC
+        Y4 = E*(X4 - B) % p - G
+        return (X3, Y3), (X4, Y4)
+
+    def _XYCZdblJac_int(self, P):
+        '''XYCZdblJac on raw integers'''
+        p = self.p
+        X, Y, Z = P
+
+        ZZ = Z*Z % p
+        M = 3*(X*X % p) - 3*(ZZ*ZZ % p)
+        YY = 2*(Y*Y % p)
+        S = 2*YY*X % p
+        X1 = M*M % p - 2*S
+        YYYY = 2*(YY*YY % p)
+        Y1 = (S - X1)*M % p - YYYY
+        return (X1, Y1), (S, YYYY)
+
+    def _ladder_int(self, k, P, skip=-1):
+        '''same as ladder, with the 'int' backend'''
+        p = self.p
+        x, y = P[0].a, P[1].a
+        R1, R0 = self._XYCZdblJac_int((x, y, 1))
+
+        n = k.bit_length()
+        condition = 0
+        for i in range(n - 2, 0, -1):
+            ki = (k >> i) & 1
+            condition ^= ki
+            R0, R1 = conditional_swap(condition, R0, R1)
+            R0, R1 = self._XYCZaddC_int(R0, R1)
+            R0, R1 = self._XYCZadd_int(R0, R1)
+            if i != skip: condition = ki # fault on step "skip"
+
+        # processing last bit and recovery of missing Z coordinate
+        ki = k & 1
+        condition ^= ki
+        R0, R1 = conditional_swap(condition, R0, R1)
+        R0, R1 = self._XYCZaddC_int(R0, R1)
+        lambdaX, lambdaY = self._Z_recovery_int(ki, (x, y), R0, R1)
+        R0, R1 = self._XYCZadd_int(R0, R1)
+        R0, R1 = conditional_swap(ki, R0, R1)
+        X, Y = R0
+        return self.field(X*lambdaX), self.field(Y*lambdaY)
+
 
 ## scalar multiplications with different randomization methods
 
@@ -693,17 +1204,28 @@ def ecdsa_verify(curve, pubkey, msg, sig):
     sinv = invmod(s, curve.order)
     u = msg*sinv % curve.order
     v = r*sinv % curve.order
-    U = curve.ladder(u, curve.base)
-    V = curve.ladder(v, pubkey)
-    Q = curve.add_aff(U, V)
+    Q = curve._jac_to_affine_int(curve._mul_double_jac_int(u, v, pubkey))
     return Q[0].to_int() % curve.order == r, Q
 
 
+def ecdsa_verify_batch(curve, pubkey, list_sig):
+    '''Same as ecdsa_verify on a list of (msg, r, s), with one inversion for the whole list'''
+    points = []
+    for msg, r, s in list_sig:
+        sinv = invmod(s, curve.order)
+        u = msg*sinv % curve.order
+        v = r*sinv % curve.order
+        points.append(curve._mul_double_jac_int(u, v, pubkey))
+
+    points = curve._jac_to_affine_batch_int(points)
+    return [(Q[0].to_int() % curve.order == r, Q) for (msg, r, s), Q in zip(list_sig, points)]
+
+
 ## gen keypair
 
 def generate_keypair(curve):
     privkey = randint(1, curve.order - 1)
-    pubkey = curve.ladder(privkey, curve.base)
+    pubkey = curve.mul_base(privkey)
     return privkey, pubkey
 
 
@@ -714,6 +1236,17 @@ def points_from_sig(curve, pubkey, msg, sig):
 
     QQ_list = curve.lift_x(sig[0])
     return valid, Q, QQ_list
+
+
+def points_from_sigs(curve, pubkey, list_sig):
+    '''Same as points_from_sig on a list of (msg, r, s), with a batch verification of the signatures'''
+    res = []
+    for (msg, r, s), (valid, Q) in zip(list_sig, ecdsa_verify_batch(curve, pubkey, list_sig)):
+        if valid:
+            res.append((valid, Q, []))
+        else:
+            res.append((valid, Q, curve.lift_x(r)))
+    return res
     
 
 SECP256R1 = {
@@ -760,6 +1293,18 @@ SCALAR_MULT_MODE = {
     'euclsplit': scalar_mult_splitting_eucl
 }
 
+ARITH_BACKENDS = ('int', 'field')
+
+# size in bits of the windows of the fixed-base table of the base point (see Curve._base_table_int)
+BASE_WINDOW = 6
+
+# size in bits of the windows of the table of a point shared by several scalar multiplications (see Curve.mul_many)
+MANY_WINDOW = 4
+
+# widths of the wNAF for the double-scalar multiplication [u]G + [v]P of the verification (see Curve._mul_double_jac_int)
+BASE_WNAF = 7
+POINT_WNAF = 5
+
 CURVE_TYPE = {
     'Jac': CurveJac,
     'XZ' : CurveXZ,
@@ -3,6 +3,7 @@
 import sys
 import argparse
 from pydfa.dfa_analysis import *
+from pydfa.dfa_pipeline import *
 
 if __name__ == "__main__":
 
@@ -23,35 +24,43 @@ if __name__ == "__main__":
         
         parser.add_argument('--fname', action='store', dest='fname', type=str,
                             help='To the results of analysis for use with HNP solver', required=True)
+
+        parser.add_argument('--tables', action='store', dest='table_dir', type=str,
+                            help='Directory where baby-step tables are saved and reused between runs')
+
+        parser.add_argument('--jobs', action='store', dest='jobs', type=int, default=1,
+                            help='Number of processes for the generation and the DFA analysis of the signatures')
+
+        parser.add_argument('--seed', action='store', dest='seed', type=int,
+                            help='Seed of the random generators for a reproducible simulation')
+
+        parser.add_argument('--dlog', action='store', dest='dlog', type=str, default='bsgs', choices=DLOG_METHODS,
+                            help=f'Discrete logarithm method, choose amongst: {DLOG_METHODS} (auto: BSGS if its table fits in memory)')
     
         args = parser.parse_args()
+        if args.table_dir is not None:
+            set_table_dir(args.table_dir)
+        set_dlog_method(args.dlog)
 
         curve = CurveJac(CURVES[args.curve_name])
 
         # key pair generation
+        if args.seed is not None:
+            random.seed(args.seed)
         privkey, pubkey = generate_keypair(curve)
         print(f'Key pair generated on curve {curve.name}:')
         print(f'    Private key: {privkey}')
         print(f'    Public key : ({pubkey[0].hex()},')
         print(f'                  {pubkey[1].hex()})')
               
-        # simulate "nsig" ECDSA signatures with a fault
-        print(f'Generating {args.nsig} signatures')
-        list_sig = simulation_ecdsa(curve, privkey, 'multsplit', args.nsig, args.skip, args.llambda)
-
-        # DFA analysis
-        print(f'DFA analysis on the signatures')
-        Ui, Vi, Li = batch_analysis_ecdsa_multsplit(curve, pubkey, list_sig, args.skip, args.llambda)
-        n = len(Ui)
+        # simulate "nsig" ECDSA signatures with a fault, analysed and written to the file as they are generated
+        print(f'Generating and analysing {args.nsig} signatures')
+        sigs = sign_stage(curve, privkey, 'multsplit', args.nsig, args.skip, args.llambda, seed=args.seed, jobs=args.jobs)
+        rows = analysis_pipeline(curve, pubkey, sigs, 'multsplit', args.skip, args.llambda,
+                                 filename=args.fname, jobs=args.jobs, total=args.nsig)
+        n = sum(1 for row in rows)
         print(f'Number of invalid signatures: {n}')
         print(f'Expect at least {(curve.order.bit_length() + args.skip - 1)//(args.skip)} signatures for HNP to succeed')
-        
-        f = open(args.fname, 'w')        
-        # We only keep the curve name and the public key
-        f.write(f'{curve.name},{pubkey[0].hex()},{pubkey[1].hex()}\n')
-        for u,v,L in zip(Ui,Vi,Li):
-            f.write(f'{u:x},{v:x},{L}\n')
-        f.close()
 
         print(f'The results of the analysis are stored in {args.fname}')
 
@@ -1,33 +1,31 @@
 #!/usr/bin/env python3
 
 import sys
-from fpylll import IntegerMatrix, BKZ
+import time
+import argparse
+import random
+from fpylll import IntegerMatrix, LLL, BKZ
 from pydfa.ec import *
+from pydfa.dfa_parallel import parallel_map
+from pydfa.dfa_leakfile import load_leaks, export_csv
 from math import log2
 
-def load_data(filename):
+# delay in seconds between two reads of the file with option --follow
+FOLLOW_DELAY = 2
 
-    f = open(filename, 'r')
-    
-    line = f.readline()
-    sp = line.strip().split(',')
-    curve_name = sp[0]
-    curve = CurveJac(CURVES[curve_name])
-    pubkey = curve.field(int(sp[1], 16)), curve.field(int(sp[2], 16))
+# block sizes of the successive BKZ reductions of the incremental solver (option --incremental)
+BKZ_BLOCK_SIZES = (10, 20, 30)
 
-    Ui, Vi, Li = [], [], []
+# number of rows of the file used by the pre-filter of the candidate keys
+PREFILTER_ROWS = 8
 
-    line = f.readline()
-    while len(line) != 0:
-        sp = line.strip().split(',')
-        Ui.append(int(sp[0],16))
-        Vi.append(int(sp[1],16))
-        Li.append(int(sp[2]))
-        line = f.readline()
-        
-    f.close()
+# block sizes of BKZ and maximal number of lattices of the solver with random subsets of rows (option --subsets)
+SUBSET_BLOCK_SIZES = (15, 20, 25, 30)
+SUBSET_ATTEMPTS = 1000
 
-    return curve, pubkey, Ui, Vi, Li
+def load_data(filename):
+    '''Returns curve, pubkey, Ui, Vi, Li from a file in the text or binary format (see dfa_leakfile)'''
+    return load_leaks(filename)
 
 
 def generate_hnp_matrix(curve, Ui, Vi, Li):
@@ -44,11 +42,32 @@ def generate_hnp_matrix(curve, Ui, Vi, Li):
     return M
     
 
-def solve_hnp(curve, pubkey, Ui, Vi, Li):
+def extend_basis(curve, rows, u, v, L):
+    '''
+    Basis (list of rows) of the lattice of generate_hnp_matrix with one more signature (u, v, L),
+    from any basis `rows` of the lattice of the previous signatures (e.g. already reduced).
+    In a vector of the lattice, the column of u is the coefficient of the row of the Ui and the column of v
+    is the coefficient of the row of the Vi times the order: they give the value of the new column.
+    '''
+    res = []
+    for row in rows:
+        a, b = row[-2], row[-1]//curve.order
+        res.append(row[:-2] + [2*L*(a*u + b*v), a, row[-1]])
+    n = len(rows[0]) - 2
+    res.append([0]*n + [2*L*curve.order, 0, 0])
+    return res
+
 
-    # **approximately** determines a minimal number of signatures for HNP to work
-    # it might avoids too large computation or on the contrary useless
-    # computation when the number of elements is too low
+def matrix_rows(M):
+    return [[M[i, j] for j in range(M.ncols)] for i in range(M.nrows)]
+
+
+def min_signatures(curve, Li):
+    '''
+    **approximately** determines a minimal number of signatures for HNP to work
+    it might avoids too large computation or on the contrary useless
+    computation when the number of elements is too low
+    '''
     nbits = 0
     n = 0
     for L in Li:
@@ -56,48 +75,220 @@ def solve_hnp(curve, pubkey, Ui, Vi, Li):
         n += 1
         if nbits >= curve.order.bit_length():
             break
+    return n
+
+
+def prefilter(curve, key, Ui, Vi, Li):
+    '''
+    Cheap check of a candidate key x with the rows (u, v, L) of the file: for the private key, u*x - v mod order is
+    at most about order/(2*L) in absolute value (the unknown part of the nonce minus the center of its interval).
+    The key or its opposite must satisfy at least half of the rows (a few of them may be wrong).
+    '''
+    for x in (key, curve.order - key):
+        ok = 0
+        for u, v, L in zip(Ui, Vi, Li):
+            w = (u*x - v) % curve.order
+            if L*min(w, curve.order - w) <= curve.order:
+                ok += 1
+        if 2*ok >= len(Ui):
+            return True
+    return False
+
+
+def key_candidate(curve, a, pubkey, Ui, Vi, Li):
+    '''Returns the private key if given by the coefficient a of a row of the reduced basis, None otherwise'''
+    key = abs(a) % curve.order
+    if key == 0 or not prefilter(curve, key, Ui, Vi, Li):
+        return None
+
+    Q = curve.mul_base(key)
+    if Q[0].to_int() == pubkey[0]:
+        if Q[1].to_int() == pubkey[1]:
+            return key
+        else:
+            return curve.order - key
+    return None
+
+
+def check_key(curve, pubkey, M, Ui, Vi, Li):
+    '''
+    Returns (True, key) if a row of the reduced basis M gives the private key, (False, -1) otherwise.
+    The candidates are pre-filtered with the first rows of the file (see prefilter), then checked against
+    the public key (only a few of them pass the pre-filter, so it is done in this process).
+    '''
+    pubkey = pubkey[0].to_int(), pubkey[1].to_int()
+    U, V, L = Ui[:PREFILTER_ROWS], Vi[:PREFILTER_ROWS], Li[:PREFILTER_ROWS]
+    for i in range(M.nrows):
+        key = key_candidate(curve, M[i, M.ncols - 2], pubkey, U, V, L)
+        if key is not None:
+            return True, key
+
+    return False, -1
+
+
+def solve_hnp(curve, pubkey, Ui, Vi, Li, start=0):
+
+    n = min_signatures(curve, Li)
     
-    # we start with the first n elements
+    # we start with the first n elements (or more if smaller values have already been tried)
+    n = max(n, start)
     while n <= len(Ui):
         print(f'HNP with {n} signatures...')
         M = generate_hnp_matrix(curve, Ui[:n], Vi[:n], Li[:n])
         Mreduced = BKZ.reduction(M, BKZ.Param(block_size=30))
         n += 1
-        for i in range(Mreduced.nrows):
-            row = Mreduced[i]
-            key = abs(row[-2]) % curve.order
-            if key == 0:
-                continue
-            Q = curve.ladder(key, curve.base)
-            if Q[0] == pubkey[0]:
-                if Q[1] == pubkey[1]:
-                    return True, key
-                else:
-                    return True, curve.order - key
+        found, key = check_key(curve, pubkey, Mreduced, Ui, Vi, Li)
+        if found:
+            return found, key
                 
     return False, -1
 
 
-def print_instructions():
-    print('Command is "python3 solve_hnp.py filename')
+def solve_hnp_incremental(curve, pubkey, Ui, Vi, Li, start=0, basis=None):
+    '''
+    Same as solve_hnp, but the reduced basis for n signatures is the starting point of the reduction for n + 1
+    (see extend_basis): LLL first, then BKZ with the block sizes BKZ_BLOCK_SIZES, and the key is checked after each
+    reduction to stop as soon as it is found.
+    The reduced basis for all the signatures is returned to continue with more (option --follow).
+    Returns (found, key, basis).
+    '''
+    if basis is None:
+        n = max(min_signatures(curve, Li), start)
+        if n > len(Ui):
+            return False, -1, None
+        M = generate_hnp_matrix(curve, Ui[:n], Vi[:n], Li[:n])
+    else:
+        n = len(basis) - 2
+        if n >= len(Ui):
+            return False, -1, basis
+        n += 1
+        M = IntegerMatrix.from_matrix(extend_basis(curve, basis, Ui[n - 1], Vi[n - 1], Li[n - 1]))
+
+    while True:
+        print(f'HNP with {n} signatures...')
+        M = LLL.reduction(M)
+        found, key = check_key(curve, pubkey, M, Ui, Vi, Li)
+        for block_size in BKZ_BLOCK_SIZES:
+            if found:
+                break
+            M = BKZ.reduction(M, BKZ.Param(block_size=block_size))
+            found, key = check_key(curve, pubkey, M, Ui, Vi, Li)
+
+        basis = matrix_rows(M)
+        if found or n == len(Ui):
+            return found, key, basis
+
+        M = IntegerMatrix.from_matrix(extend_basis(curve, basis, Ui[n], Vi[n], Li[n]))
+        n += 1
+
+
+def hnp_attempt(curve, n, block_size, seed, pubkey, Ui, Vi, Li):
+    '''
+    One lattice of solve_hnp_subsets: HNP with n rows of the file chosen at random (from `seed`) and BKZ with `block_size`.
+    Returns (key, n, block_size), key is None if not found.
+    '''
+    rows = sorted(random.Random(seed).sample(range(len(Ui)), n))
+    U, V, L = [Ui[i] for i in rows], [Vi[i] for i in rows], [Li[i] for i in rows]
+    M = generate_hnp_matrix(curve, U, V, L)
+    Mreduced = BKZ.reduction(M, BKZ.Param(block_size=block_size))
+    for i in range(Mreduced.nrows):
+        key = key_candidate(curve, Mreduced[i, Mreduced.ncols - 2], pubkey, U[:PREFILTER_ROWS], V[:PREFILTER_ROWS], L[:PREFILTER_ROWS])
+        if key is not None:
+            return key, n, block_size
+    return None, n, block_size
+
+
+def solve_hnp_subsets(curve, pubkey, Ui, Vi, Li, jobs=1, attempts=SUBSET_ATTEMPTS, seed=None):
+    '''
+    HNP on random subsets of the rows, with a random number of rows (from the minimal one to all of them)
+    and a random block size amongst SUBSET_BLOCK_SIZES, so that a few wrong rows in the file do not prevent
+    from finding the key. The lattices are reduced by `jobs` processes, the first key found stops all of them.
+    '''
+    n_min = min_signatures(curve, Li)
+    if n_min > len(Ui):
+        return False, -1
+
+    rng = random.Random(seed)
+    lattices = ((rng.randint(n_min, len(Ui)), rng.choice(SUBSET_BLOCK_SIZES), rng.getrandbits(64)) for _ in range(attempts))
+    args = (pubkey[0].to_int(), pubkey[1].to_int()), Ui, Vi, Li
+    for key, n, block_size in parallel_map(curve, hnp_attempt, lattices, args, jobs, chunksize=1, ordered=False):
+        print(f'HNP with {n} random signatures (block size {block_size})...')
+        if key is not None:
+            return True, key      # leaving parallel_map terminates the other processes
+
+    return False, -1
+
+
+def follow_hnp(filename, curve, pubkey, Ui, Vi, Li, incremental=False):
+    '''Tries HNP each time new rows are appended to the file (while the analysis is running)'''
+    start = 0
+    basis = None
+    while True:
+        if incremental:
+            found, key, basis = solve_hnp_incremental(curve, pubkey, Ui, Vi, Li, start, basis)
+        else:
+            found, key = solve_hnp(curve, pubkey, Ui, Vi, Li, start)
+        if found:
+            return found, key
+
+        start = len(Ui) + 1
+        print(f'Waiting for more signatures in {filename}...')
+        while len(Ui) < start:
+            time.sleep(FOLLOW_DELAY)
+            curve, pubkey, Ui, Vi, Li = load_data(filename)
 
 
 if __name__ == "__main__":
-    argc = len(sys.argv) - 1
 
-    if argc != 1:
-        print_instructions()
-        sys.exit()
+    parser = argparse.ArgumentParser(description='Reconstruct a private key from the results of the DFA analysis with lattice techniques')
+
+    parser.add_argument('filename', type=str,
+                        help='File of the results of the analysis')
+
+    parser.add_argument('--follow', action='store_true', dest='follow',
+                        help='Wait for new rows appended to the file until the private key is found')
+
+    parser.add_argument('--incremental', action='store_true', dest='incremental',
+                        help='Reuse the reduced basis when a signature is added (LLL then BKZ with increasing block sizes)')
+
+    parser.add_argument('--subsets', action='store_true', dest='subsets',
+                        help='Lattices with random subsets of the rows and random block sizes, reduced in parallel (robust to wrong rows)')
+
+    parser.add_argument('--attempts', action='store', dest='attempts', type=int, default=SUBSET_ATTEMPTS,
+                        help='Maximal number of lattices with option --subsets')
+
+    parser.add_argument('--seed', action='store', dest='seed', type=int,
+                        help='Seed of the random subsets of option --subsets')
+
+    parser.add_argument('--jobs', action='store', dest='jobs', type=int, default=1,
+                        help='Number of processes for the lattices with option --subsets')
+
+    parser.add_argument('--export', action='store', dest='csv_filename', type=str,
+                        help='Only write the rows of the file (binary format) in this file in the text format')
+
+    args = parser.parse_args()
 
     try:
-        filename = sys.argv[1]   
+        filename = args.filename
+        if args.csv_filename is not None:
+            export_csv(filename, args.csv_filename)
+            print(f'The rows of {filename} are stored in {args.csv_filename}')
+            sys.exit()
+
         curve, pubkey, Ui, Vi, Li = load_data(filename)
 
         print(f'Elliptic curve: {curve.name}')
         print(f'    Public key: ({pubkey[0].hex()},')
         print(f'                 {pubkey[1].hex()})')
 
-        found, key = solve_hnp(curve, pubkey, Ui, Vi, Li)
+        if args.follow:
+            found, key = follow_hnp(filename, curve, pubkey, Ui, Vi, Li, args.incremental)
+        elif args.subsets:
+            found, key = solve_hnp_subsets(curve, pubkey, Ui, Vi, Li, args.jobs, args.attempts, args.seed)
+        elif args.incremental:
+            found, key, basis = solve_hnp_incremental(curve, pubkey, Ui, Vi, Li)
+        else:
+            found, key = solve_hnp(curve, pubkey, Ui, Vi, Li)
 
         if found:
             print(f'Private key: {key}')
@@ -106,5 +297,3 @@ if __name__ == "__main__":
 
     except Exception as e:
         print(e)
-        print_instructions()
-    
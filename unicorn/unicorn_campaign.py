@@ -0,0 +1,582 @@
+#!/usr/bin/env python3
+
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from hashlib import sha256
+from multiprocessing import Pool
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from rainbow.generics import rainbow_x64
+
+sys.path.insert(0, '../pysimul/')
+from pydfa.ec import *
+from pydfa.dfa_analysis import dfa_swap_dlogs, sweep_steps, sweep_leak, AnalysisContext
+
+# Campaigns of faults on a scalar multiplication emulated with Rainbow:
+#
+#   - the golden (fault-free) execution is run once, and snapshots of the CPU and of the memory are taken
+#     on its way at the positions (numbers of executed instructions) of the campaign, at most one
+#     every SNAPSHOT_INTERVAL instructions;
+#   - each faulty execution restores the nearest snapshot before its position, runs up to the position,
+#     injects the fault and resumes until the end of the scalar multiplication;
+#   - with several processes, the positions are split in small contiguous blocks (at most SNAPSHOT_INTERVAL
+#     positions, and a few blocks per process) distributed to the processes, each block with its own emulator
+#     and snapshots; the results are yielded in order as soon as their block is done;
+#   - several fault models (see FAULT_MODELS) can be injected at each position from the same snapshots.
+
+# minimal number of instructions between two snapshots of the golden execution
+SNAPSHOT_INTERVAL = 4096
+
+# file of the index of a golden trace (see TraceIndex)
+TRACE_MAGIC = b'DFATRC\x00\x01'
+
+
+class Target:
+    '''
+    Execution of `function` of the binary `fname`: the memory is initialized with `inputs` (address -> bytes)
+    and the registers with `registers` (name -> value), and the affine point of 64 bytes written at `result`
+    is the output. `stubs` are the functions replaced by Python functions (name -> function).
+    `buffers` gives the registers holding the addresses of the points R0 and R1 at the start of the loop
+    of the ladder (name -> register), for the faults on their content.
+    '''
+
+    def __init__(self, fname, function, inputs, registers, result, stubs=None, buffers=None):
+        self.fname = fname
+        self.function = function
+        self.inputs = inputs
+        self.registers = registers
+        self.result = result
+        self.stubs = dict() if stubs is None else stubs
+        self.buffers = dict() if buffers is None else buffers
+
+
+class Emulator:
+    '''Emulator of a target, with the snapshots of its golden execution'''
+
+    def __init__(self, target, buffers=None):
+        self.target = target
+        self.e = None
+        self.snapshots = []     # sorted list of (position, snapshot)
+        self.buffers = dict() if buffers is None else buffers   # addresses of R0 and R1 (see buffer_addresses)
+
+    def load(self, sca_mode=False):
+        '''New emulator at the start of the execution of the target (with sca_mode=True, the addresses are traced)'''
+        e = rainbow_x64(sca_mode=sca_mode)
+        e.load(self.target.fname, typ='.elf')
+        for name, func in self.target.stubs.items():
+            e.stubbed_functions[name] = func
+        e.trace = sca_mode
+
+        for address, data in self.target.inputs.items():
+            e[address] = data
+        for name, value in self.target.registers.items():
+            e[name] = value
+        self.e = e
+        return e
+
+    def snapshot(self):
+        '''CPU context and content of all the mapped memory'''
+        emu = self.e.emu
+        memory = [(begin, bytes(emu.mem_read(begin, end - begin + 1))) for begin, end, perms in emu.mem_regions()]
+        return emu.context_save(), memory
+
+    def restore(self, snapshot):
+        context, memory = snapshot
+        emu = self.e.emu
+        for begin, data in memory:
+            emu.mem_write(begin, data)
+        emu.context_restore(context)
+
+    def golden(self, positions, interval=SNAPSHOT_INTERVAL):
+        '''Runs the golden execution and takes the snapshots for faults at `positions`'''
+        self.load()
+        self.snapshots = []
+        count = None
+        for pos in sorted(set(positions)):
+            if count is not None and pos - count < interval:
+                continue
+            if count is None:
+                self.e.start(self.e.functions[self.target.function], 0, count=pos)
+            else:
+                self.e.start(self.e['rip'], 0, count=pos - count)
+            count = pos
+            self.snapshots.append((pos, self.snapshot()))
+
+    def run_to(self, pos):
+        '''
+        Puts the emulator in the state of the golden execution after `pos` instructions,
+        from the nearest snapshot (or from the start if there is none before)
+        '''
+        i = bisect_right([p for p, s in self.snapshots], pos)
+        if i == 0:
+            self.load()
+            self.e.start(self.e.functions[self.target.function], 0, count=pos)
+            return self.e
+
+        count, snapshot = self.snapshots[i - 1]
+        self.restore(snapshot)
+        if pos > count:
+            self.e.start(self.e['rip'], 0, count=pos - count)
+        return self.e
+
+    def resume(self, address):
+        '''Resumes the execution at `address` until the end'''
+        return self.e.start(address, 0)
+
+    def output(self):
+        '''Returns the output point as bytes (x, y) in little-endian'''
+        result = b''
+        for i in range(8):
+            result += bytes(self.e[self.target.result + 8*i])
+        return result[:32], result[32:]
+
+    def trace(self):
+        '''Runs a full execution of the target and returns the addresses of all the instructions executed'''
+        e = self.load(sca_mode=True)
+        e.start(e.functions[self.target.function], 0)
+        return e.sca_address_trace
+
+
+class TraceIndex:
+    '''
+    Map of the golden execution of a target: for each position (number of instructions executed), the address
+    of the instruction, and the positions of the iterations of the ladder and of the xor `pbit ^= k_i`.
+    The loop of the ladder is found in the trace as the instructions of the function of the target executed
+    the most times (once per iteration), it starts with the first one of them and the xor is the only one
+    of them with mnemonic `xor`.
+    '''
+
+    def __init__(self, header, addresses):
+        self.header = header
+        self.addresses = addresses
+        self.functions = sorted((address, name) for name, address in header['functions'].items())
+        self.starts = [address for address, name in self.functions]
+        self.iterations = header['iterations']   # start of the iterations, then end of the last one
+        self.xors = header['xors']               # position of the xor in each iteration
+        self.nbits = len(self.xors)
+        self.xor_set = set(self.xors)
+
+    @classmethod
+    def build(cls, target):
+        emulator = Emulator(target)
+        addresses = emulator.trace()
+        e = emulator.e
+
+        functions = dict(e.functions)
+        start = functions[target.function]
+        end = min([a for a in functions.values() if a > start], default=2**64)
+        counts = Counter(a for a in addresses if start <= a < end)
+        nbits = max(counts.values())
+        loop = {a for a, c in counts.items() if c == nbits}
+
+        head = next(a for a in addresses if a in loop)
+        xor = {a for a in loop if e.disassemble_single(a, 16)[2] == 'xor'}
+        iterations, xors = [], []
+        last = 0
+        for pos, a in enumerate(addresses):
+            if a not in loop:
+                continue
+            last = pos
+            if a == head:
+                iterations.append(pos)
+            elif a in xor:
+                xors.append(pos)
+        iterations.append(last + 1)
+
+        header = {
+            'function'  : target.function,
+            'functions' : functions,
+            'iterations': iterations,
+            'xors'      : xors
+        }
+        return cls(header, array('Q', addresses))
+
+    def save(self, filename):
+        header = json.dumps(self.header).encode()
+        header += b' '*(-(len(TRACE_MAGIC) + 4 + len(header)) % 8)
+        addresses = array('Q', self.addresses)
+        if sys.byteorder != 'little':
+            addresses.byteswap()
+
+        tmpname = f'{filename}.{os.getpid()}.tmp'
+        with open(tmpname, 'wb') as f:
+            f.write(TRACE_MAGIC)
+            f.write(struct.pack('<I', len(header)))
+            f.write(header)
+            addresses.tofile(f)
+        os.replace(tmpname, filename)
+
+    @classmethod
+    def load(cls, filename):
+        '''Memory-maps an index saved with `save`'''
+        with open(filename, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if mm[:len(TRACE_MAGIC)] != TRACE_MAGIC:
+            raise ValueError(f'{filename} is not the index of a trace')
+        offset = len(TRACE_MAGIC) + 4
+        hlen, = struct.unpack('<I', mm[len(TRACE_MAGIC):offset])
+        header = json.loads(mm[offset:offset + hlen].decode())
+        offset += hlen
+
+        if sys.byteorder == 'little':
+            addresses = memoryview(mm)[offset:].cast('Q')
+        else:
+            addresses = array('Q', mm[offset:])
+            addresses.byteswap()
+        index = cls(header, addresses)
+        index._mmap = mm
+        return index
+
+    def _index(self, bit):
+        '''Number of the iteration that processes the bit `bit` of the scalar (the most significant bit first)'''
+        if not 0 <= bit < self.nbits:
+            raise ValueError(f'bit {bit} is not processed by the ladder (0 <= bit < {self.nbits})')
+        return self.nbits - 1 - bit
+
+    def iteration(self, bit):
+        '''Positions of the instructions of the iteration of the ladder that processes the bit `bit` of the scalar'''
+        n = self._index(bit)
+        return range(self.iterations[n], self.iterations[n + 1])
+
+    def xor(self, bit):
+        '''Position of the xor `pbit ^= k_i` of the iteration that processes the bit `bit` of the scalar'''
+        return self.xors[self._index(bit)]
+
+    def symbol(self, pos):
+        '''Name of the function of the instruction at `pos` ('xor' for the xor of the swap)'''
+        i = bisect_right(self.starts, self.addresses[pos])
+        name = self.functions[i - 1][1] if i > 0 else '?'
+        if pos in self.xor_set:
+            return f'{name} (xor)'
+        return name
+
+
+def target_digest(target):
+    '''Hash of the function and of the inputs of the execution'''
+    desc = repr((target.function, sorted(target.inputs.items()), sorted(target.registers.items())))
+    return sha256(desc.encode()).hexdigest()[:16]
+
+
+def trace_filename(target):
+    '''The index is saved next to the binary, with a hash of the inputs of the execution'''
+    return f'{target.fname}.{target_digest(target)}.trace'
+
+
+def trace_index(target):
+    '''Index of the golden trace of the target, built once and kept on disk'''
+    filename = trace_filename(target)
+    if os.path.exists(filename):
+        return TraceIndex.load(filename)
+    index = TraceIndex.build(target)
+    index.save(filename)
+    return index
+
+
+def select_positions(index, iteration=None, xor=False, skip_min=None, skip_max=None):
+    '''
+    Positions of a campaign from the index of the golden trace: all the instructions of the iteration that processes
+    the bit `iteration`, or (xor=True) the xor of the swap for the bits skip_min - 1 to skip_max - 1 (the faults
+    that the analysis can exploit with steps between skip_min and skip_max)
+    '''
+    if iteration is not None:
+        return list(index.iteration(iteration))
+    if xor:
+        return [index.xor(bit) for bit in range(max(skip_min - 1, 0), min(skip_max, index.nbits))]
+    return []
+
+
+class SkipFault:
+    '''Skips `n` consecutive instructions (in the order of the code, from the one at the position)'''
+
+    def __init__(self, n=1):
+        self.n = int(n)
+        self.spec = 'skip' if self.n == 1 else f'skip:{self.n}'
+
+    def inject(self, emulator):
+        address = emulator.e['rip']
+        for _ in range(self.n):
+            address += emulator.e.disassemble_single(address, 16)[1]
+        return address
+
+
+class RegisterBitFlip:
+    '''Flips the bit `bit` of the register `register`'''
+
+    def __init__(self, register, bit):
+        self.register = register
+        self.bit = int(bit)
+        self.spec = f'flip:{register}:{self.bit}'
+
+    def inject(self, emulator):
+        e = emulator.e
+        e[self.register] = e[self.register] ^ (1 << self.bit)
+        return e['rip']
+
+
+class RegisterZero:
+    '''Sets the register `register` to zero'''
+
+    def __init__(self, register):
+        self.register = register
+        self.spec = f'zero:{register}'
+
+    def inject(self, emulator):
+        e = emulator.e
+        e[self.register] = 0
+        return e['rip']
+
+
+class ByteFault:
+    '''Xors the byte at `offset` in the point `buffer` (R0 or R1) with `mask`'''
+
+    def __init__(self, buffer, offset, mask=0xff):
+        self.buffer = buffer
+        self.offset = int(offset)
+        self.mask = int(mask, 0) if isinstance(mask, str) else mask
+        self.spec = f'byte:{buffer}:{self.offset}:{self.mask:#04x}'
+
+    def inject(self, emulator):
+        if self.buffer not in emulator.buffers:
+            raise ValueError(f'unknown buffer {self.buffer}')
+        emu = emulator.e.emu
+        address = emulator.buffers[self.buffer] + self.offset
+        value = emu.mem_read(address, 1)[0]
+        emu.mem_write(address, bytes([value ^ self.mask]))
+        return emulator.e['rip']
+
+
+# fault models given as <name>[:<argument>...] (see fault_models)
+FAULT_MODELS = {
+    'skip': SkipFault,          # skip[:n]
+    'flip': RegisterBitFlip,    # flip:<register>:<bit>
+    'zero': RegisterZero,       # zero:<register>
+    'byte': ByteFault           # byte:<R0 or R1>:<offset>[:<mask>]
+}
+
+
+def _expand(field):
+    '''Integer ranges <a>-<b> are expanded in all the integers between a and b'''
+    if '-' in field and all(x.isdigit() for x in field.split('-', 1)):
+        a, b = field.split('-', 1)
+        return [str(i) for i in range(int(a), int(b) + 1)]
+    return [field]
+
+
+def fault_models(specs):
+    '''
+    List of fault models from their specifications, e.g. 'skip', 'skip:3', 'flip:rax:0-63', 'zero:rdi', 'byte:R1:0-95'
+    (a range <a>-<b> gives one model for each value)
+    '''
+    models = []
+    for spec in specs:
+        name, *fields = spec.split(':')
+        if name not in FAULT_MODELS:
+            raise ValueError(f'unknown fault model {name} (one of {", ".join(FAULT_MODELS)})')
+        args = [[]]
+        for field in fields:
+            args = [a + [x] for a in args for x in _expand(field)]
+        for a in args:
+            try:
+                models.append(FAULT_MODELS[name](*a))
+            except (TypeError, ValueError):
+                raise ValueError(f'invalid fault model {spec}')
+    return models
+
+
+def buffer_addresses(target):
+    '''Addresses of the buffers of the target, read in their registers at the start of the first iteration of the ladder'''
+    if len(target.buffers) == 0:
+        return dict()
+    index = trace_index(target)
+    emulator = Emulator(target)
+    e = emulator.run_to(index.iterations[0])
+    return {name: e[register] for name, register in target.buffers.items()}
+
+
+def fault_result(emulator, pos, model, curve, Q, skip_min, skip_max, sweep, ctx):
+    '''
+    Injects the fault `model` at `pos` and analyses the output: returns a dictionary with the position, the fault,
+    the instruction at the position (as given by disassemble_single), the output (x, y) in bytes, if it is on the curve,
+    and for each candidate Q' given by lift_x, the steps consistent with the output (sweep=True, see dfa_swap_sweep)
+    or the discrete logarithm of the analysis at step skip_max (None if not found), and the time of the execution
+    '''
+    result = {'position': pos, 'fault': model.spec, 'instruction': '', 'output': None, 'on_curve': None,
+              'candidates': [], 'error': None, 'time': 0.}
+    start = time.perf_counter()
+    try:
+        e = emulator.run_to(pos)
+
+        # get next instruction
+        rip = e['rip']
+        d = e.disassemble_single(rip, 8)
+        result['instruction'] = d
+
+        # inject and resume
+        emulator.resume(model.inject(emulator))
+
+        xb, yb = emulator.output()
+        result['output'] = xb, yb
+        x = int.from_bytes(xb, 'little')
+        y = int.from_bytes(yb, 'little')
+        result['on_curve'] = curve.is_on_curve((x,y))
+
+        QQ_list = curve.lift_x(x % curve.order) # what we would get from a signature
+        # both candidates Q' with a single discrete logarithm
+        for dl in dfa_swap_dlogs(curve, Q, QQ_list, skip_max, ctx):
+            if sweep:
+                result['candidates'].append([] if dl is None else sweep_steps(dl, skip_min, skip_max))
+            else:
+                result['candidates'].append(None if dl is None else dl//2)
+
+    except Exception as ex:
+        result['error'] = str(ex)
+
+    result['time'] = time.perf_counter() - start
+    return result
+
+
+def print_result(result, padded_scalar, skip_min, skip_max, sweep=False):
+    '''Prints the result of a faulty execution (see fault_result) and the bits of the padded scalar to compare with'''
+    if result['instruction'] == '':
+        return
+    if result.get('fault', 'skip') == 'skip':
+        print(f'Instruction skipped: {result["instruction"]}')
+    else:
+        print(f'Fault {result["fault"]} at instruction: {result["instruction"]}')
+    if result['output'] is None:
+        return
+
+    xb, yb = result['output']
+    print(f'  Output  : ({xb.hex()},{yb.hex()})')
+    print(f'  On curve: {result["on_curve"]}')
+    if result['error'] is not None:
+        return
+
+    print(f'  # Q\'    : {len(result["candidates"])}')
+    ctr = 0
+    for res in result['candidates']:
+        if sweep:
+            for j, lsb, conf in res:
+                print(f'  Step {j:<3} : {lsb}  kpad mod 2^{j}: {padded_scalar % 2**j}  (confidence {conf:.3f})')
+            if len(res) == 0:
+                ctr += 1
+            continue
+
+        if res is not None:
+            print(f'  Found   : {res}  kpad mod 2^{skip_max}: {padded_scalar % 2**skip_max}')
+            print(f'  Reduced : {res % 2**skip_min}  kpad mod 2^{skip_min}: {padded_scalar % 2**skip_min}')
+        else:
+            ctr += 1
+    if ctr == len(result['candidates']):
+        print('  Analysis found nothing')
+    print('')
+
+
+def print_throughput(results):
+    '''Prints the number of faulty executions and their throughput for each fault model of `results`'''
+    runs, times = dict(), dict()
+    for result in results:
+        runs[result['fault']] = runs.get(result['fault'], 0) + 1
+        times[result['fault']] = times.get(result['fault'], 0.) + result['time']
+    for fault in runs:
+        rate = runs[fault]/times[fault] if times[fault] > 0 else float('inf')
+        print(f'{fault:<20}: {runs[fault]} runs in {times[fault]:.2f} s ({rate:.1f} runs/s per process)')
+
+
+def campaign_params(target, skip_min, skip_max, sweep):
+    '''Parameters of a campaign in a result store (see pydfa.dfa_results), the positions and faults are in the rows'''
+    return {'binary': os.path.basename(target.fname), 'function': target.function, 'inputs': target_digest(target),
+            'skip': [skip_min, skip_max], 'sweep': sweep}
+
+
+def recovered_bits(result, skip_max, sweep=False):
+    '''
+    Returns (status, nbits, lsb) from the candidates of a result of fault_result: the bits of the scalar given by the
+    only candidate Q' with a solution (`lsb` = kpad mod 2^nbits), or the status 'nothing found' or 'ambiguous'
+    '''
+    if result['error'] is not None:
+        return 'error', None, None
+    if sweep:
+        found = [steps for steps in result['candidates'] if len(steps) > 0]
+    else:
+        found = [dl for dl in result['candidates'] if dl is not None]
+    if len(found) == 0:
+        return 'nothing found', None, None
+    if len(found) > 1:
+        return 'ambiguous', None, None
+    if sweep:
+        nbits, lsb = sweep_leak(found[0])
+        return 'found', nbits, lsb
+    return 'found', skip_max, found[0]
+
+
+def store_result(store, result, padded_scalar, skip_max, sweep=False):
+    '''Appends a result of fault_result in a ResultStore, with the bits of the padded scalar as ground truth'''
+    status, nbits, lsb = recovered_bits(result, skip_max, sweep)
+    x, y = None, None
+    if result['output'] is not None:
+        x, y = (int.from_bytes(c, 'little') for c in result['output'])
+    store.append(result['position'], result['fault'], result['instruction'], x, y, result['on_curve'],
+                 len(result['candidates']), nbits, lsb, None if nbits is None else padded_scalar % 2**nbits,
+                 status, result['time'], result['error'])
+
+
+# curve, point Q = [scalar]G and analysis context of the blocks run by a process, see _block_state
+_blocks = dict()
+
+
+def _block_state(curve_type, params, scalar, skip_max):
+    '''Curve, Q and context of analysis for the blocks of a campaign, built once per process'''
+    key = curve_type, repr(params), scalar, skip_max
+    if key not in _blocks:
+        _blocks.clear()
+        curve = curve_type(params)
+        _blocks[key] = curve, curve.mul_base(scalar), AnalysisContext(curve, skip_max)
+    return _blocks[key]
+
+
+def _fault_block(task):
+    '''Yields the results of the faults on a block of positions, with a new emulator and its own snapshots'''
+    target, buffers, positions, models, curve_type, params, scalar, skip_min, skip_max, sweep, interval = task
+    curve, Q, ctx = _block_state(curve_type, params, scalar, skip_max)
+
+    emulator = Emulator(target, buffers)
+    emulator.golden(positions, interval)
+    for pos in positions:
+        for model in models:
+            yield fault_result(emulator, pos, model, curve, Q, skip_min, skip_max, sweep, ctx)
+
+
+def _sweep_block(task):
+    '''Results of _fault_block as a list (task of the pool of processes)'''
+    return list(_fault_block(task))
+
+
+def fault_sweep(target, positions, models, curve, scalar, skip_min, skip_max, sweep=False, jobs=1,
+                interval=SNAPSHOT_INTERVAL):
+    '''
+    Yields the results of fault_result for each position of `positions` (sorted) and each fault model of `models`
+    (see fault_models), in order and as soon as they are computed.
+    With `jobs` processes, the positions are split in blocks of at most `interval` positions (at least 4 blocks
+    per process if there are enough positions), and the results of a block are yielded when it is done.
+    '''
+    positions = sorted(positions)
+    buffers = buffer_addresses(target) if any(isinstance(m, ByteFault) for m in models) else dict()
+    if jobs <= 1:
+        yield from _fault_block((target, buffers, positions, models, type(curve), curve.params, scalar, skip_min,
+                                 skip_max, sweep, interval))
+        return
+
+    size = max(1, min(interval, -(-len(positions)//(4*jobs))))
+    tasks = ((target, buffers, positions[i:i + size], models, type(curve), curve.params, scalar, skip_min, skip_max,
+              sweep, interval) for i in range(0, len(positions), size))
+
+    with Pool(jobs) as pool:
+        for results in pool.imap(_sweep_block, tasks):
+            yield from results
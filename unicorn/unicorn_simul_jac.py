@@ -2,11 +2,12 @@
 
 import argparse
 import sys
-from rainbow.generics import rainbow_x64
 
 sys.path.insert(0, '../pysimul/')
 from pydfa.ec import *
-from pydfa.dfa_analysis import dfa_swap_analysis
+from pydfa.dfa_results import ResultStore
+from unicorn_campaign import Target, Emulator, fault_sweep, fault_models, print_result, print_throughput, trace_index, \
+                             select_positions, campaign_params, store_result, SNAPSHOT_INTERVAL
 
 
 def memcpy(em):
@@ -16,108 +17,80 @@ def memcpy(em):
     return True
 
 
-def get_trace(fname, scalar):
-    '''Runs a full execution of the scalar multiplication and traces all instructions'''
-    
-    e = rainbow_x64(sca_mode=True)
-    e.load(fname, typ='.elf')
-    e.stubbed_functions['memcpy'] = memcpy
-    e.trace = True
-    
-    # load scalar in stack and reserve space
-    # for the result of scalar multiplication
+def ladder_target(fname, scalar):
+    '''Scalar multiplication of the binary with the scalar in memory and space reserved for the result'''
     scalar_addr = 0xdead0000
     res_addr = 0xbeef0000
-    e[scalar_addr] = scalar.to_bytes(33, 'little')
-    e[res_addr] = b'\x00'*64
-
-    # load arguments and launch the full execution
-    e['rdi'] = res_addr
-    e['rsi'] = scalar_addr
-    ret = e.start(e.functions['ladder_jac'], 0)
+    inputs = {scalar_addr: scalar.to_bytes(33, 'little'), res_addr: b'\x00'*64}
+    registers = {'rdi': res_addr, 'rsi': scalar_addr}
+    # points R0 and R1 of the ladder (see ladderjac_asm.txt)
+    buffers = {'R0': 'rbx', 'R1': 'r12'}
+    return Target(fname, 'ladder_jac', inputs, registers, res_addr, {'memcpy': memcpy}, buffers)
 
-    result = b''
-    for i in range(8):
-        result += bytes(e[res_addr + 8*i])
-    x = result[:32]
-    y = result[32:]
 
-    return e.sca_address_trace, (int.from_bytes(x, 'little'), int.from_bytes(y, 'little'))
+def get_trace(fname, scalar):
+    '''Runs a full execution of the scalar multiplication and traces all instructions'''
+    emulator = Emulator(ladder_target(fname, scalar))
+    trace = emulator.trace()
+    x, y = emulator.output()
+    return trace, (int.from_bytes(x, 'little'), int.from_bytes(y, 'little'))
 
 
-def fault_simulation(fname, scalar, position, width, skip_min, skip_max):
+def fault_simulation(fname, scalar, position, width, skip_min, skip_max, sweep=False,
+                     snapshot_interval=SNAPSHOT_INTERVAL, jobs=1, iteration=None, xor=False, faults=('skip',),
+                     db=None):
     '''
     Executes many scalar multiplications with a same scalar,
-    but a skip instruction in different positions in the interval [position - width, position + width]
+    but a fault in different positions in the interval [position - width, position + width]
+    (each fault model of `faults` at each position, see fault_models; a skip instruction by default)
+    (with sweep=True, all the steps of the fault in [skip_min, skip_max] consistent with the output are listed).
+    The golden execution is run once, with snapshots every `snapshot_interval` instructions in the interval,
+    for each part of the interval run by the `jobs` processes. The results are printed in order, as they come.
+    Instead of the interval, the positions can be taken from the index of the golden trace: all the instructions
+    of the iteration of the ladder that processes the bit `iteration`, or (xor=True) the xor of the swap of the
+    iterations of the bits skip_min - 1 to skip_max - 1.
+    With `db`, the results are also appended to this SQLite database (see pydfa.dfa_results) and the positions
+    already in it for the same campaign are skipped, so that an interrupted campaign can be resumed.
+    Returns the list of the results (see fault_result).
     '''
 
     print('')
     curve = CurveJac(SECP256R1)
     padded_scalar = scalar_padding(curve, scalar)
-    Q = curve.ladder(scalar, curve.base)
 
+    models = fault_models(faults)
+    target = ladder_target(fname, scalar)
+
+    # golden execution with snapshots, each faulty execution starts from the nearest one,
+    # positions split in parts run by `jobs` processes
+    if iteration is not None or xor:
+        index = trace_index(target)
+        positions = select_positions(index, iteration, xor, skip_min, skip_max)
+        print(f'{len(positions)} instructions selected in the golden trace ({len(index.addresses)} instructions)')
+    else:
+        positions = range(position - width, position + width + 1)
+    store = None
+    if db is not None:
+        store = ResultStore(db, campaign_params(target, skip_min, skip_max, sweep))
+        done = store.done()
+        todo = [pos for pos in positions if any((pos, model.spec) not in done for model in models)]
+        if len(todo) < len(positions):
+            print(f'{len(positions) - len(todo)} instructions already in {db}')
+        positions = todo
+
+    # the rows not yet committed are kept if the campaign is interrupted
     results = []
-    for pos in range(position - width, position + width + 1):
-        try:
-            e = rainbow_x64()
-            e.load(fname, typ='.elf')
-            e.stubbed_functions['memcpy'] = memcpy
-            e.trace = False
-            
-            # load scalar in stack and reserve space
-            # for the result of scalar multiolication
-            scalar_addr = 0xdead0000
-            res_addr = 0xbeef0000
-
-            e[scalar_addr] = scalar.to_bytes(33, 'little')
-            e[res_addr] = b'\x00'*64
-            e['rdi'] = res_addr
-            e['rsi'] = scalar_addr
-            ret = e.start(e.functions['ladder_jac'], 0, count=pos)
-            
-            # get next instruction
-            rip = e['rip']
-            d = ''
-            d = e.disassemble_single(rip, 8)
-            print(f'Instruction skipped: {d}')
-        
-            # skip and resume
-            ret = e.start(rip + d[1], 0)
-            
-            result = b''
-            for i in range(8):
-                result += bytes(e[res_addr + 8*i])
-            xb = result[:32]
-            yb = result[32:]
-
-            print(f'  Output  : ({xb.hex()},{yb.hex()})')
-            x = int.from_bytes(xb, 'little')
-            y = int.from_bytes(yb, 'little')
-            print(f'  On curve: {curve.is_on_curve((x,y))}')
-            results.append((d, (x,y)))
-
-            if d == '':
-                print('')
-                continue
-            QQ_list = curve.lift_x(x % curve.order) # what we would get from a signature
-            print(f'  # Q\'    : {len(QQ_list)}')
-            ctr = 0
-            for QQ in QQ_list:
-                found, dl = dfa_swap_analysis(curve, Q, QQ, skip_max)
-                if found:
-                    # print(f'Instruction skipped: {d}')
-                    # print(f'  on Curve: {on_curve}')
-                    print(f'  Found   : {dl}  kpad mod 2^{skip_max}: {padded_scalar % 2**skip_max}')
-                    print(f'  Reduced : {dl % 2**skip_min}  kpad mod 2^{skip_min}: {padded_scalar % 2**skip_min}')
-                else:
-                    ctr += 1
-            if ctr == len(QQ_list):
-                print('  Analysis found nothing')
-            print('')
-                    
-        except Exception as ex:
-            results.append((d, (0,0)))
-        
+    try:
+        for result in fault_sweep(target, positions, models, curve, scalar, skip_min, skip_max, sweep, jobs, snapshot_interval):
+            print_result(result, padded_scalar, skip_min, skip_max, sweep)
+            if store is not None:
+                store_result(store, result, padded_scalar, skip_max, sweep)
+            results.append(result)
+    finally:
+        if store is not None:
+            store.close()
+
+    print_throughput(results)
     return results
 
 
@@ -130,13 +103,33 @@ if __name__ == "__main__":
         parser.add_argument('--scalar', action='store', dest='scalar', type=int,
                             help='Scalar', required=True)
         parser.add_argument('--inst', action='store', dest='position', type=int,
-                            help='Position of instruction to skip', required=True)
-        parser.add_argument('--width', action='store', dest='width', type=int, required=True)
+                            help='Position of instruction to skip')
+        parser.add_argument('--width', action='store', dest='width', type=int, default=0)
+        parser.add_argument('--iteration', action='store', dest='iteration', type=int,
+                            help='Skip every instruction of the iteration of the ladder processing this bit of the scalar (instead of --inst)')
+        parser.add_argument('--xor', action='store_true', dest='xor',
+                            help='Skip the xor of the swap in the iterations matching the loop iterations (min, max) (instead of --inst)')
         parser.add_argument('--skip', action='store', nargs=2, dest='skip', type=int,
                             help='loop iteration (min, max)', required=True)
+        parser.add_argument('--fault', action='append', dest='faults',
+                            help='Fault model, can be repeated: skip[:n], flip:<register>:<bit>, zero:<register>, '
+                                 'byte:<R0|R1>:<offset>[:<mask>] (ranges <a>-<b> accepted), default skip')
+        parser.add_argument('--sweep', action='store_true', dest='sweep',
+                            help='List all the loop iterations between min and max consistent with each faulty output')
+        parser.add_argument('--snapshots', action='store', dest='snapshot_interval', type=int, default=SNAPSHOT_INTERVAL,
+                            help='Minimal number of instructions between two snapshots of the golden execution')
+
+        parser.add_argument('--db', action='store', dest='db', type=str,
+                            help='SQLite database where the results are appended (resumes the campaign if already started)')
+        parser.add_argument('--jobs', action='store', dest='jobs', type=int, default=1,
+                            help='Number of processes, each part of the interval is run by one of them')
 
         args = parser.parse_args()
-        results = fault_simulation(fname, args.scalar, args.position, args.width, args.skip[0], args.skip[1])
+        if args.position is None and args.iteration is None and not args.xor:
+            parser.error('one of --inst, --iteration or --xor is required')
+        results = fault_simulation(fname, args.scalar, args.position, args.width, args.skip[0], args.skip[1], args.sweep,
+                                   args.snapshot_interval, args.jobs, args.iteration, args.xor,
+                                   args.faults or ('skip',), args.db)
 
     except Exception as ex:
         print(ex)